@@ -0,0 +1,772 @@
+#!/usr/bin/env python3
+"""
+A bytecode compiler and stack machine for the Scheme dialect in
+LISP_interpreter.py, so that Scheme files can be compiled once and shipped or
+cached in compiled form.
+
+    import LISP_bytecode as bytecode
+
+    code = bytecode.compile_program(LISP_interpreter.parse_all(source))
+    data = bytecode.dumps(code)             #bytes, e.g. to save to a file
+    bytecode.run(bytecode.loads(data))      #value of the last expression
+
+or simply
+    bytecode.evaluate_file("program.scm")
+
+which compiles the file only if it has changed since it was last compiled,
+keeping the compiled code in a __pycache__ directory next to the file and
+in memory (see ModuleCache).
+
+A Code object holds a flat list of integers (an opcode followed by one
+operand per instruction), a pool of constants, the Codes of the lambdas in
+it and the Scopes of its lets.  Variables are resolved to frame slots at
+compile time exactly as LISP_interpreter.compile_expression does, and the
+frames are the interpreter's own (Frames at the top level, SlotFrames for
+calls and lets), so compiled code and the interpreter can share a global
+frame and call each other's functions.  Calls between compiled functions
+are made by the loop in execute without Python recursion, and calls in tail
+position reuse the caller's frame.  Primitives are the functions in
+scheme_builtins, and malformed special forms are handed to their helpers
+there at run time, so errors are the same SchemeError subclasses the
+interpreter raises.
+"""
+import os
+import sys
+import time
+import marshal
+import hashlib
+from array import array
+from collections import OrderedDict
+
+from LISP_interpreter import (
+    Frames, Scope, SlotFrame, lookup, missing, is_name, defined_names,
+    special_forms, rebound_special_forms, scheme_builtins, parse_all,
+    SchemeEvaluationError,
+)
+
+
+#bump when the instructions or the serialized format change
+MAGIC = b'SCMB\x03'
+
+OPNAMES = [
+    'CONST', 'NAME', 'LOCAL', 'OUTER', 'FREE', 'STORE', 'STORE_SLOT', 'POP',
+    'JUMP', 'JUMP_UNLESS_TRUE', 'AND_TEST', 'OR_TEST', 'CALLABLE', 'CALL',
+    'TAILCALL', 'IS_BEGIN', 'RETURN', 'LAMBDA', 'HELPER', 'DELETE', 'SET',
+    'ENTER_LET', 'LEAVE_LET', 'EMPTY', 'SPECIAL',
+]
+(CONST, NAME, LOCAL, OUTER, FREE, STORE, STORE_SLOT, POP,
+ JUMP, JUMP_UNLESS_TRUE, AND_TEST, OR_TEST, CALLABLE, CALL,
+ TAILCALL, IS_BEGIN, RETURN, LAMBDA, HELPER, DELETE, SET,
+ ENTER_LET, LEAVE_LET, EMPTY, SPECIAL) = range(len(OPNAMES))
+
+
+class Code():
+    """
+    Compiled code: ops is a flat list of [opcode, operand, opcode, operand,
+    ...], constants, codes and scopes are the pools the operands index, and
+    scope is the Scope of a function body's frames (None for a program,
+    which runs in the frame it is given).
+    """
+    def __init__(self, ops, constants, codes, scopes, scope=None):
+        self.ops = ops
+        self.constants = constants
+        self.codes = codes
+        self.scopes = scopes
+        self.scope = scope
+    def __repr__(self):
+        return f'<Code: {len(self.ops) // 2} instructions>'
+
+
+class CodeBuilder():
+    """
+    Collects the instructions and pools of one Code while it is compiled.
+    """
+    def __init__(self, scope=None):
+        self.scope = scope
+        self.ops = []
+        self.constants = []
+        self.constant_index = {}
+        self.codes = []
+        self.scopes = []
+    def emit(self, op, arg=0):
+        self.ops += [op, arg]
+        return len(self.ops) - 1
+    def constant(self, value):
+        #keyed by type too, so 1, 1.0 and True aren't merged
+        try:
+            key = (type(value), value)
+            index = self.constant_index.get(key)
+        except TypeError:
+            key = index = None
+        if index is None:
+            index = len(self.constants)
+            self.constants.append(value)
+            if key is not None:
+                self.constant_index[key] = index
+        return index
+    def jump(self, op):
+        """
+        Emits a jump and returns its operand's position, to be patched with
+        land once the target is known.
+        """
+        return self.emit(op)
+    def land(self, position):
+        self.ops[position] = len(self.ops)
+    def build(self):
+        return Code(self.ops, self.constants, self.codes, self.scopes, self.scope)
+
+
+def compile_program(trees):
+    """
+    Compiles a list of parsed top-level expressions into the Code of a
+    program, which evaluates them in order and gives the value of the last.
+    """
+    builder = CodeBuilder()
+    if not trees:
+        builder.emit(CONST, builder.constant(None))
+    for i, tree in enumerate(trees):
+        if i:
+            builder.emit(POP)
+        compile_into(builder, tree, False, None)
+    builder.emit(RETURN)
+    return builder.build()
+
+
+def compile_into(builder, tree, tail, scope):
+    """
+    Emits the code of one expression, leaving its value on the stack (or, in
+    tail position, possibly making a TAILCALL that returns from the code).
+    Follows LISP_interpreter.compile_expression form for form.
+    """
+    if tree == []:
+        builder.emit(EMPTY)
+        return
+    if not isinstance(tree, list):
+        if isinstance(tree, str):
+            compile_reference(builder, tree, scope)
+        else:
+            builder.emit(CONST, builder.constant(tree))
+        return
+    car, cdr = tree[0], tree[1:]
+    if car in special_forms:
+        #in case car is bound to something else when this runs (see
+        #LISP_interpreter.compile_special_form_guard); the end of the form
+        #is filled in below
+        guard = builder.constant([car, cdr, 0])
+        builder.emit(SPECIAL, guard)
+        compiler = form_compilers.get(car)
+        if compiler is None or not compiler(builder, cdr, tail, scope):
+            #malformed, so its helper can fail the way it always has
+            builder.emit(HELPER, builder.constant((car, cdr)))
+        builder.constants[guard][2] = len(builder.ops)
+        return
+    compile_into(builder, car, False, scope)
+    builder.emit(CALLABLE)
+    if not tail:
+        for arg in cdr:
+            compile_into(builder, arg, False, scope)
+        builder.emit(CALL, len(cdr))
+        return
+    for arg in cdr[:-1]:
+        compile_into(builder, arg, False, scope)
+    if car == 'begin' and cdr:
+        #if the function turns out to be the builtin begin, its last argument
+        #is in tail position; otherwise it's an ordinary argument
+        builder.emit(IS_BEGIN, len(cdr) - 1)
+        not_begin = builder.jump(JUMP)
+        compile_into(builder, cdr[-1], True, scope)
+        done = builder.jump(JUMP)
+        builder.land(not_begin)
+        compile_into(builder, cdr[-1], False, scope)
+        builder.emit(TAILCALL, len(cdr))
+        builder.emit(RETURN)
+        builder.land(done)
+        return
+    if cdr:
+        compile_into(builder, cdr[-1], False, scope)
+    builder.emit(TAILCALL, len(cdr))
+    builder.emit(RETURN)
+
+
+def compile_reference(builder, name, scope):
+    if scope is None:
+        builder.emit(NAME, builder.constant(name))
+        return
+    depth, slot = scope.resolve(name)
+    if slot is None:
+        builder.emit(FREE, builder.constant((depth, name)))
+    elif depth == 0:
+        builder.emit(LOCAL, slot)
+    else:
+        builder.emit(OUTER, builder.constant((depth, slot, name)))
+
+
+def compile_store(builder, name, scope):
+    slot = scope.index.get(name) if scope is not None and is_name(name) else None
+    if slot is None:
+        builder.emit(STORE, builder.constant(name))
+    else:
+        builder.emit(STORE_SLOT, slot)
+
+
+def compile_if(builder, args, tail, scope):
+    if len(args) < 3:
+        return False
+    compile_into(builder, args[0], False, scope)
+    false_branch = builder.jump(JUMP_UNLESS_TRUE)
+    compile_into(builder, args[1], tail, scope)
+    done = builder.jump(JUMP)
+    builder.land(false_branch)
+    compile_into(builder, args[2], tail, scope)
+    builder.land(done)
+    return True
+
+
+def compile_and_or(test, result):
+    def compile_form(builder, args, tail, scope):
+        exits = []
+        for arg in args:
+            compile_into(builder, arg, False, scope)
+            exits.append(builder.jump(test))
+        builder.emit(CONST, builder.constant(result))
+        for position in exits:
+            builder.land(position)
+        return True
+    return compile_form
+
+
+def compile_lambda(builder, args, tail, scope):
+    if len(args) < 2:
+        return False
+    params, body = args[0], args[1]
+    if not isinstance(params, list) or not all(is_name(param) for param in params):
+        #odd parameters can't be given slots; lambda_helper handles them by name
+        builder.emit(HELPER, builder.constant(('lambda', args)))
+        return True
+    body_builder = CodeBuilder(Scope(defined_names(body), scope, params))
+    compile_into(body_builder, body, True, body_builder.scope)
+    body_builder.emit(RETURN)
+    builder.codes.append(body_builder.build())
+    builder.emit(LAMBDA, len(builder.codes) - 1)
+    return True
+
+
+def compile_define(builder, args, tail, scope):
+    if len(args) < 2 or (isinstance(args[0], list) and not args[0]):
+        return False
+    name, body = args[0], args[1]
+    if isinstance(name, list):
+        compile_lambda(builder, [name[1:], body], True, scope)
+        name = name[0]
+    else:
+        compile_into(builder, body, False, scope)
+    compile_store(builder, name, scope)
+    return True
+
+
+def compile_del(builder, args, tail, scope):
+    if not args:
+        return False
+    builder.emit(DELETE, builder.constant(args[0]))
+    return True
+
+
+def compile_let(builder, args, tail, scope):
+    if len(args) != 2 or not isinstance(args[0], list):
+        return False
+    if any(not isinstance(binding, list) or len(binding) < 2 or not is_name(binding[0])
+           for binding in args[0]):
+        return False
+    names = [binding[0] for binding in args[0]]
+    for binding in args[0]:
+        names.extend(defined_names(binding[1]))
+    let_scope = Scope(names + defined_names(args[1]), scope)
+    builder.scopes.append(let_scope)
+    builder.emit(ENTER_LET, len(builder.scopes) - 1)
+    for binding in args[0]:
+        compile_into(builder, binding[1], False, let_scope)
+        builder.emit(STORE_SLOT, let_scope.index[binding[0]])
+        builder.emit(POP)
+    compile_into(builder, args[1], tail, let_scope)
+    builder.emit(LEAVE_LET)
+    return True
+
+
+def compile_set(builder, args, tail, scope):
+    if len(args) < 2:
+        return False
+    compile_into(builder, args[1], False, scope)
+    builder.emit(SET, builder.constant(args[0]))
+    return True
+
+
+form_compilers = {
+    'if': compile_if,
+    'and': compile_and_or(AND_TEST, '#t'),
+    'or': compile_and_or(OR_TEST, '#f'),
+    'lambda': compile_lambda,
+    'define': compile_define,
+    'del': compile_del,
+    'let': compile_let,
+    'set!': compile_set,
+}
+
+
+class Closure():
+    """
+    A function made by running the code of a lambda: calling it runs code in
+    a new SlotFrame of code.scope whose parent is frame.
+    """
+    __slots__ = ('code', 'frame')
+    def __init__(self, code, frame):
+        self.code = code
+        self.frame = frame
+    def enter(self, items):
+        scope = self.code.scope
+        if len(items) != len(scope.params):
+            raise SchemeEvaluationError("Invalid number of arguments")
+        return SlotFrame(self.frame, scope, scope.bind(items))
+    def __call__(self, items):
+        return execute(self.code, self.enter(items))
+    def __repr__(self):
+        return 'function'
+
+
+def run(code, frame=None):
+    """
+    Runs the Code of a program in frame (a new global frame if not given)
+    and returns its value.
+    """
+    if frame is None:
+        frame = Frames()
+    return execute(code, frame)
+
+
+def execute(code, env):
+    """
+    Runs code in the frame env and returns its value.  Calls to Closures
+    save the caller on a list instead of recursing, so only calls into
+    Python functions (builtins and the interpreter's Functions) use the
+    Python stack.
+    """
+    ops, constants = code.ops, code.constants
+    pc = 0
+    stack = []
+    #(code, pc, env) of each compiled caller waiting for a result
+    calls = []
+    while True:
+        op, arg = ops[pc], ops[pc + 1]
+        pc += 2
+        if op == LOCAL:
+            value = env.slots[arg]
+            if value is missing:
+                value = lookup(env.parent, env.scope.names[arg])
+            stack.append(value)
+        elif op == CONST:
+            stack.append(constants[arg])
+        elif op == CALL or op == TAILCALL:
+            if arg:
+                items = stack[-arg:]
+                del stack[-arg:]
+            else:
+                items = []
+            function = stack.pop()
+            if function.__class__ is Closure:
+                new_env = function.enter(items)
+                if op == CALL:
+                    calls.append((code, pc, env))
+                code, env, pc = function.code, new_env, 0
+                ops, constants = code.ops, code.constants
+            else:
+                stack.append(function(items))
+        elif op == CALLABLE:
+            if not callable(stack[-1]):
+                raise SchemeEvaluationError("Cannot call non-function")
+        elif op == NAME:
+            stack.append(lookup(env, constants[arg]))
+        elif op == JUMP_UNLESS_TRUE:
+            if stack.pop() != '#t':
+                pc = arg
+        elif op == JUMP:
+            pc = arg
+        elif op == RETURN:
+            if not calls:
+                return stack.pop()
+            code, pc, env = calls.pop()
+            ops, constants = code.ops, code.constants
+        elif op == OUTER:
+            depth, slot, name = constants[arg]
+            frame = env
+            for _ in range(depth):
+                if frame.extra is not None and name in frame.extra:
+                    stack.append(frame.extra[name])
+                    break
+                frame = frame.parent
+            else:
+                value = frame.slots[slot]
+                if value is missing:
+                    value = lookup(frame.parent, name)
+                stack.append(value)
+        elif op == FREE:
+            depth, name = constants[arg]
+            frame = env
+            for _ in range(depth):
+                if frame.extra is not None and name in frame.extra:
+                    stack.append(frame.extra[name])
+                    break
+                frame = frame.parent
+            else:
+                stack.append(lookup(frame, name))
+        elif op == POP:
+            stack.pop()
+        elif op == AND_TEST:
+            if stack.pop() == '#f':
+                stack.append('#f')
+                pc = arg
+        elif op == OR_TEST:
+            if stack.pop() == '#t':
+                stack.append('#t')
+                pc = arg
+        elif op == IS_BEGIN:
+            #skips the jump that follows if the function is the builtin begin
+            if stack[-arg - 1] is scheme_builtins['begin']:
+                del stack[-arg - 1:]
+                pc += 2
+        elif op == STORE_SLOT:
+            env.slots[arg] = stack[-1]
+        elif op == STORE:
+            env[constants[arg]] = stack[-1]
+        elif op == LAMBDA:
+            stack.append(Closure(code.codes[arg], env))
+        elif op == ENTER_LET:
+            scope = code.scopes[arg]
+            env = SlotFrame(env, scope, scope.bind(()))
+        elif op == LEAVE_LET:
+            env = env.parent
+        elif op == SET:
+            stack.append(env.set_frame(constants[arg], stack.pop()))
+        elif op == DELETE:
+            stack.append(env.delete_item(constants[arg]))
+        elif op == HELPER:
+            car, cdr = constants[arg]
+            stack.append(scheme_builtins[car](cdr, env))
+        elif op == SPECIAL:
+            #a special form whose name may be bound to something else, which
+            #is then called on the unevaluated arguments instead
+            name, args, end = constants[arg]
+            if name in rebound_special_forms:
+                value = lookup(env, name)
+                if value is not scheme_builtins[name]:
+                    if not callable(value):
+                        raise SchemeEvaluationError("Cannot call non-function")
+                    stack.append(value(args, env))
+                    pc = end
+        elif op == EMPTY:
+            raise SchemeEvaluationError("Empty expression")
+        else:
+            raise ValueError(f"bad opcode {op}")
+
+
+#################
+# Serialization #
+#################
+
+def code_to_tuple(code):
+    scope = None if code.scope is None else (code.scope.names, list(code.scope.params))
+    return (array('I', code.ops).tobytes(), code.constants,
+            [code_to_tuple(child) for child in code.codes],
+            [(s.names, list(s.params)) for s in code.scopes], scope)
+
+
+def code_from_tuple(data):
+    ops, constants, codes, scopes, scope = data
+    #constants that are tuples (references) come back as tuples; the (car,
+    #cdr) pairs of helpers only need to unpack
+    return Code(array('I', ops).tolist(), constants,
+                [code_from_tuple(child) for child in codes],
+                [Scope(names, None, params) for names, params in scopes],
+                None if scope is None else Scope(scope[0], None, scope[1]))
+
+
+def dumps(code):
+    """
+    Returns the bytes of a Code, to be read back with loads.
+    """
+    return MAGIC + marshal.dumps(code_to_tuple(code))
+
+
+def loads(data):
+    """
+    Returns the Code serialized in data by dumps, raising ValueError if it
+    was written by a different version of this module.
+    """
+    if not data.startswith(MAGIC):
+        raise ValueError("not compiled Scheme code, or from another version")
+    return code_from_tuple(marshal.loads(data[len(MAGIC):]))
+
+
+###########
+# Caching #
+###########
+
+#a file whose mtime is this close to when it was last hashed may have changed
+#again within the same tick, so its mtime alone can't be trusted
+RACY_NS = 2 * 10**9
+
+
+class ModuleEntry():
+    """
+    The compiled Code of a file as of the given size, mtime and SHA-256 of its
+    contents (checked at time checked_ns), plus the frame made by running it
+    once, if it has been loaded as a module.  nbytes is its size on disk.
+    """
+    def __init__(self, path, size, mtime_ns, digest, checked_ns, code):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.digest = digest
+        self.checked_ns = checked_ns
+        self.code = code
+        self.frame = None
+        self.nbytes = 0
+    def to_bytes(self):
+        return MAGIC + marshal.dumps((self.path, self.size, self.mtime_ns, self.digest,
+                                      self.checked_ns, code_to_tuple(self.code)))
+    @staticmethod
+    def from_bytes(data):
+        if not data.startswith(MAGIC):
+            raise ValueError("not a compiled Scheme module, or from another version")
+        path, size, mtime_ns, digest, checked_ns, code = marshal.loads(data[len(MAGIC):])
+        entry = ModuleEntry(path, size, mtime_ns, digest, checked_ns, code_from_tuple(code))
+        entry.nbytes = len(data)
+        return entry
+
+
+class ModuleCache():
+    """
+    Caches compiled Scheme files on disk and in memory, so loading the same
+    files again skips reading, tokenizing and parsing them.
+
+    On disk, each file has one entry in cache_dir (by default a __pycache__
+    directory next to the file) recording its size, mtime and SHA-256 along
+    with its Code.  An entry is valid if:
+      - the file's size and mtime are the recorded ones, and the mtime is
+        more than RACY_NS older than when the hash was taken, in which case
+        the file isn't read at all; or else
+      - the SHA-256 of the file's contents is the recorded one (e.g. the
+        file was only touched), in which case the entry is rewritten with
+        the new mtime.
+    Otherwise, or if the entry is missing, unreadable or from another version
+    of this module, the file is compiled again and its entry rewritten.
+
+    In memory, up to max_modules entries are kept in least recently used
+    order and checked against their files with the same rules every time
+    they are used.  The frame of a module is kept with its entry, so it is
+    dropped when the file changes.
+    """
+    def __init__(self, cache_dir=None, max_modules=64):
+        self.cache_dir = cache_dir
+        self.max_modules = max_modules
+        self.loaded = OrderedDict()
+        self.memory_hits = 0
+        self.memory_misses = 0
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.evictions = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def entry_path(self, path):
+        directory = self.cache_dir or os.path.join(os.path.dirname(path), '__pycache__')
+        name = hashlib.sha256(path.encode()).hexdigest()[:16]
+        return os.path.join(directory, f'{os.path.basename(path)}.{name}.scmc')
+
+    def read_source(self, path):
+        with open(path, 'rb') as f:
+            source = f.read()
+        self.bytes_read += len(source)
+        return source
+
+    def check(self, entry, path, stat, source=None):
+        """
+        Returns whether entry still holds the code of the file at path (whose
+        os.stat is stat), and the file's contents if they had to be read.
+        """
+        if entry.path != path or entry.size != stat.st_size:
+            return False, source
+        if entry.mtime_ns == stat.st_mtime_ns and stat.st_mtime_ns + RACY_NS < entry.checked_ns:
+            return True, source
+        checked_ns = time.time_ns()
+        if source is None:
+            source = self.read_source(path)
+        if hashlib.sha256(source).hexdigest() != entry.digest:
+            return False, source
+        entry.mtime_ns, entry.checked_ns = stat.st_mtime_ns, checked_ns
+        return True, source
+
+    def write(self, entry):
+        data = entry.to_bytes()
+        entry.nbytes = len(data)
+        entry_path = self.entry_path(entry.path)
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            #written under another name first, so no one reads half a file
+            temporary = f'{entry_path}.{os.getpid()}.tmp'
+            with open(temporary, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, entry_path)
+            self.bytes_written += len(data)
+        except OSError:
+            pass
+
+    def load(self, path, stat, source):
+        """
+        Returns the entry for path from disk, or compiles the file (whose
+        contents are source, if already read) and saves a new entry.
+        """
+        try:
+            with open(self.entry_path(path), 'rb') as f:
+                data = f.read()
+            self.bytes_read += len(data)
+            entry = ModuleEntry.from_bytes(data)
+        except (OSError, ValueError, EOFError, TypeError):
+            entry = None
+        if entry is not None:
+            checked_ns = entry.checked_ns
+            valid, source = self.check(entry, path, stat, source)
+            if valid:
+                self.disk_hits += 1
+                #save the new mtime or check time, so it needn't be hashed again
+                if entry.checked_ns != checked_ns:
+                    self.write(entry)
+                return entry
+        self.disk_misses += 1
+        checked_ns = time.time_ns()
+        if source is None:
+            source = self.read_source(path)
+        code = compile_program(parse_all(source.decode()))
+        entry = ModuleEntry(path, stat.st_size, stat.st_mtime_ns,
+                            hashlib.sha256(source).hexdigest(), checked_ns, code)
+        self.write(entry)
+        return entry
+
+    def entry(self, file_name):
+        """
+        Returns the up to date ModuleEntry of a Scheme file.
+        """
+        path = os.path.abspath(file_name)
+        stat = os.stat(path)
+        entry = self.loaded.get(path)
+        source = None
+        if entry is not None:
+            valid, source = self.check(entry, path, stat)
+            if valid:
+                self.memory_hits += 1
+                self.loaded.move_to_end(path)
+                return entry
+            del self.loaded[path]
+        self.memory_misses += 1
+        entry = self.loaded[path] = self.load(path, stat, source)
+        while len(self.loaded) > self.max_modules:
+            self.loaded.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def code(self, file_name):
+        """
+        Returns the compiled Code of a Scheme file.
+        """
+        return self.entry(file_name).code
+
+    def module(self, file_name):
+        """
+        Returns the global frame made by running a Scheme file, running it
+        only the first time (or when it has changed).  The frame is shared by
+        everyone loading the file, so code using a library should run in a
+        Frames whose parent is the module's frame rather than in the frame
+        itself.
+        """
+        entry = self.entry(file_name)
+        if entry.frame is None:
+            frame = Frames()
+            run(entry.code, frame)
+            entry.frame = frame
+        return entry.frame
+
+    def invalidate(self, file_name=None):
+        """
+        Forgets a file (or every file, if none is given) in memory and on disk,
+        for when a file may have changed without its size or mtime changing
+        (e.g. restored along with its old mtime).
+        """
+        paths = list(self.loaded) if file_name is None else [os.path.abspath(file_name)]
+        for path in paths:
+            self.loaded.pop(path, None)
+            try:
+                os.remove(self.entry_path(path))
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "entries": len(self.loaded),
+            "max_modules": self.max_modules,
+            "modules": sum(entry.frame is not None for entry in self.loaded.values()),
+            "bytes": sum(entry.nbytes for entry in self.loaded.values()),
+            "memory_hits": self.memory_hits,
+            "memory_misses": self.memory_misses,
+            "disk_hits": self.disk_hits,
+            "disk_misses": self.disk_misses,
+            "evictions": self.evictions,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+        }
+
+
+#used by the functions below
+modules = ModuleCache()
+
+
+def load_compiled(file_name):
+    """
+    Returns the compiled Code of a Scheme file, using the module cache.
+    """
+    return modules.code(file_name)
+
+
+def load_module(file_name):
+    """
+    Returns the (shared) global frame of a Scheme file; see ModuleCache.module.
+    """
+    return modules.module(file_name)
+
+
+def evaluate_file(file_name, current_frame=None):
+    """
+    Evaluates every expression in a Scheme file with the bytecode machine and
+    returns the value of the last one, using the module cache.
+    """
+    return run(load_compiled(file_name), current_frame)
+
+
+def disassemble(code, indent=''):
+    """
+    Returns a readable listing of code and the code of its lambdas.
+    """
+    lines = []
+    for pc in range(0, len(code.ops), 2):
+        op, arg = code.ops[pc], code.ops[pc + 1]
+        detail = ''
+        if op in (CONST, NAME, OUTER, FREE, STORE, SET, DELETE, HELPER, SPECIAL):
+            detail = f'({code.constants[arg]!r})'
+        elif op == LOCAL or op == STORE_SLOT:
+            detail = f'({code.scope.names[arg] if code.scope and op == LOCAL else arg})'
+        lines.append(f'{indent}{pc:5} {OPNAMES[op]:<17}{arg} {detail}'.rstrip())
+        if op == LAMBDA:
+            lines.append(disassemble(code.codes[arg], indent + '    '))
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    for file_name in sys.argv[1:]:
+        print(evaluate_file(file_name))
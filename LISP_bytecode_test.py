@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+import os
+import sys
+import glob
+import time
+
+import pytest
+
+#the bytecode module imports LISP_interpreter by name, so use the same module
+#here (rather than lab) to share its classes and exceptions
+import LISP_interpreter as lab
+import LISP_bytecode as bytecode
+
+TEST_DIRECTORY = os.path.dirname(__file__)
+
+nil_rep = lab.result_and_frame(lab.parse(["nil"]))[0]
+
+
+def list_from_ll(ll):
+    if isinstance(ll, lab.Pair):
+        if ll.cdr == nil_rep:
+            return [list_from_ll(ll.car)]
+        return [list_from_ll(ll.car)] + list_from_ll(ll.cdr)
+    elif ll == nil_rep:
+        return []
+    elif isinstance(ll, (float, int)):
+        return ll
+    else:
+        return "SOMETHING"
+
+
+def run_interpreter(program):
+    """
+    Evaluates each expression (a string) of program in turn in one global
+    frame with the interpreter, returning the value of each or the name of
+    the exception it raised.
+    """
+    frame = lab.Frames(lab.scheme_builtins)
+    results = []
+    for source in program:
+        try:
+            results.append(list_from_ll(lab.evaluate(lab.parse(lab.tokenize(source)), frame)))
+        except Exception as e:
+            results.append(type(e).__name__)
+    return results
+
+
+def run_vm(program):
+    """
+    Like run_interpreter, but compiles each expression to bytecode (passing it
+    through dumps and loads) and runs it on the stack machine.
+    """
+    frame = lab.Frames(lab.scheme_builtins)
+    results = []
+    for source in program:
+        try:
+            code = bytecode.loads(bytecode.dumps(bytecode.compile_program(lab.parse_all(source))))
+            results.append(list_from_ll(bytecode.run(code, frame)))
+        except Exception as e:
+            results.append(type(e).__name__)
+    return results
+
+
+def input_programs():
+    programs = []
+    for file_name in sorted(glob.glob(os.path.join(TEST_DIRECTORY, "test_inputs", "*.scm"))):
+        with open(file_name) as f:
+            lines = [line.strip() for line in f]
+        program = []
+        for line in lines:
+            try:
+                lab.parse(lab.tokenize(line))
+            except lab.SchemeSyntaxError:
+                continue
+            program.append(line)
+        programs.append((file_name, program))
+    return programs
+
+
+@pytest.mark.parametrize("file_name,program", input_programs())
+def test_vm_matches_interpreter_on_test_inputs(file_name, program):
+    assert run_vm(program) == run_interpreter(program), file_name
+
+
+@pytest.mark.parametrize("file_name", sorted(glob.glob(os.path.join(TEST_DIRECTORY, "test_files", "*.scm"))))
+def test_vm_matches_interpreter_on_test_files(file_name):
+    expected = list_from_ll(lab.evaluate_file(file_name))
+    with open(file_name) as f:
+        code = bytecode.compile_program(lab.parse_all(f.read()))
+    assert list_from_ll(bytecode.run(bytecode.loads(bytecode.dumps(code)))) == expected
+
+
+def test_vm_matches_interpreter():
+    cases = [
+        ("(define (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))", "SOMETHING"),
+        ("(fib 15)", 610),
+        ("(fib 1 2)", "SchemeEvaluationError"),
+        ("(let ((a 1) (b 2)) (* a b))", 2),
+        ("(and #t (undefined))", "SchemeNameError"),
+        ("(or #t (undefined))", "SOMETHING"),
+        ("(if (or #f (> 3 2)) 1 2)", 1),
+        ("(define x 1)", 1),
+        ("(define (f x) (begin (del x) x))", "SOMETHING"),
+        ("(f 5)", 1),
+        ("(define (g c) (begin (if (equal? c 1) (define y 5) 0) y))", "SOMETHING"),
+        ("(g 1)", 5),
+        ("(g 0)", "SchemeNameError"),
+        ("(define (mk a) (lambda (b) (let ((c 3)) (lambda (d) (+ a b c d x)))))", "SOMETHING"),
+        ("(((mk 10) 20) 40)", 74),
+        ("(define (counter) (let ((n 0)) (lambda () (begin (set! n (+ n 1)) n))))", "SOMETHING"),
+        ("(define tick (counter))", "SOMETHING"),
+        ("(tick)", 1),
+        ("(tick)", 2),
+        ("(define (map f l) (if (equal? l nil) nil (cons (f (car l)) (map f (cdr l)))))", "SOMETHING"),
+        ("(map (lambda (v) (* v v)) (list 1 2 3))", [1, 4, 9]),
+        ("(list-ref (append (list 1 2) (list 3)) 2)", 3),
+        ("(set! z 1)", "SchemeNameError"),
+        ("(1 2)", "SchemeEvaluationError"),
+    ]
+    program = [source for source, _ in cases]
+    results = run_vm(program)
+    assert results == run_interpreter(program)
+    assert results == [expected for _, expected in cases]
+
+
+def test_rebound_special_forms():
+    program = [
+        "(define (f) (and #t #f))",
+        "(f)",
+        "(define and 5)",
+        "(and 1 2)",
+        "(f)",
+        "(define (g or) (or #t #t))",
+        "(g 3)",
+        "(define (h x) (let ((if 3)) (if x 1 2)))",
+        "(h #t)",
+        "(if #t 1 2)",
+        "(define (k) (begin (define let 4) (let ((a 1)) a)))",
+        "(k)",
+    ]
+    #the frames binding these names are thrown away after the test, so
+    #forget them and let later tests skip looking the names up
+    rebound = set(lab.rebound_special_forms)
+    try:
+        results = run_vm(program)
+        assert results == run_interpreter(program)
+        assert [results[i] for i in (1, 3, 4, 6, 8, 9, 11)] == [
+            "SOMETHING", "SchemeEvaluationError", "SchemeEvaluationError", "SchemeEvaluationError",
+            "SchemeEvaluationError", 1, "SchemeEvaluationError",
+        ]
+    finally:
+        lab.rebound_special_forms.intersection_update(rebound)
+
+
+def test_dumps_loads_round_trip():
+    source = """
+        (define (compose f g) (lambda (x) (f (g x))))
+        (define (add n) (lambda (x) (+ x n)))
+        (let ((h (compose (add 1) (add 10))))
+          (list (h 1) (h 2.5) (if (> (h 0) 10) #t #f)))
+    """
+    code = bytecode.compile_program(lab.parse_all(source))
+    data = bytecode.dumps(code)
+    assert data.startswith(bytecode.MAGIC)
+    copy = bytecode.loads(data)
+    assert bytecode.dumps(copy) == data
+    assert bytecode.disassemble(copy) == bytecode.disassemble(code)
+    assert list_from_ll(bytecode.run(copy)) == list_from_ll(bytecode.run(code)) == [12, 13.5, "SOMETHING"]
+    for bad in [b"", b"junk", b"SCMB\x01" + data[len(bytecode.MAGIC):]]:
+        with pytest.raises(ValueError):
+            bytecode.loads(bad)
+
+
+def test_deep_tail_recursion():
+    program = [
+        "(define (loop n acc) (if (equal? n 0) acc (loop (- n 1) (+ acc 1))))",
+        "(loop 200000 0)",
+        "(define (even? n) (if (equal? n 0) 1 (odd? (- n 1))))",
+        "(define (odd? n) (if (equal? n 0) 0 (let ((m (- n 1))) (begin m (even? m)))))",
+        "(even? 100001)",
+        "(define (down n) (and (> n -1) (or (equal? n 0) (down (- n 1)))))",
+        "(down 100000)",
+    ]
+    assert run_vm(program) == ["SOMETHING", 200000, "SOMETHING", "SOMETHING", 0, "SOMETHING", "SOMETHING"]
+
+
+def test_deep_non_tail_recursion():
+    #calls between compiled functions don't use the Python stack
+    program = [
+        "(define (deep n) (if (equal? n 0) 0 (+ 1 (deep (- n 1)))))",
+        "(deep %d)" % (4 * sys.getrecursionlimit()),
+        "(define (build n) (if (equal? n 0) nil (cons n (build (- n 1)))))",
+        "(length (build 10000))",
+    ]
+    assert run_vm(program) == ["SOMETHING", 4 * sys.getrecursionlimit(), "SOMETHING", 10000]
+
+
+def test_error_propagation():
+    program = [
+        "(define (bad n) (if (equal? n 0) (car 1) (+ 1 (bad (- n 1)))))",
+        "(bad 50)",
+        "(define (missing n) (if (equal? n 0) undefined-name (missing (- n 1))))",
+        "(missing 100)",
+        "(define (two a b) a)",
+        "(two 1)",
+        "((lambda (f) (f 1 2 3)) two)",
+        "(define r (let ((q 2)) (nope q)))",
+        "r",
+        "(bad 0 1)",
+        "(begin (define ok 7) (car ()) (define ok 8))",
+        "ok",
+        "(+ 1 (bad 3))",
+    ]
+    results = run_vm(program)
+    assert results == run_interpreter(program)
+    assert results == [
+        "SOMETHING", "SchemeEvaluationError", "SOMETHING", "SchemeNameError", "SOMETHING",
+        "SchemeEvaluationError", "SchemeEvaluationError", "SchemeNameError", "SchemeNameError",
+        "SchemeEvaluationError", "SchemeEvaluationError", 7, "SchemeEvaluationError",
+    ]
+
+    #errors raised deeper than the Python recursion limit unwind the whole VM
+    #stack and leave the frame usable
+    assert run_vm(program[:1] + ["(bad 5000)", "(define (ok) 3)", "(+ (ok) (bad 0))", "(ok)"]) == [
+        "SOMETHING", "SchemeEvaluationError", "SOMETHING", "SchemeEvaluationError", 3,
+    ]
+
+
+def test_interpreter_and_vm_functions_mix():
+    frame = lab.Frames(lab.scheme_builtins)
+    lab.evaluate(lab.parse(lab.tokenize("(define (twice f x) (f (f x)))")), frame)
+    bytecode.run(bytecode.compile_program(lab.parse_all("(define (inc x) (+ x 1))")), frame)
+    assert bytecode.run(bytecode.compile_program(lab.parse_all("(twice inc 5)")), frame) == 7
+    assert lab.evaluate(lab.parse(lab.tokenize("(twice inc 1)")), frame) == 3
+
+
+def write_source(path, source, mtime_ns):
+    with open(path, "w") as f:
+        f.write(source)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def evaluate_cached(cache, file_name):
+    return bytecode.run(cache.code(file_name), lab.Frames(lab.scheme_builtins))
+
+
+def test_module_cache_counters(tmp_path):
+    old = time.time_ns() - 10 * bytecode.RACY_NS
+    a = write_source(tmp_path / "a.scm", "(define x 2) (* x 3)", old)
+    b = write_source(tmp_path / "b.scm", "(+ 1 2)", old)
+    cache = bytecode.ModuleCache(cache_dir=str(tmp_path / "cache"), max_modules=1)
+    assert evaluate_cached(cache, a) == 6
+    assert evaluate_cached(cache, a) == 6
+    assert evaluate_cached(cache, b) == 3
+    assert evaluate_cached(cache, a) == 6
+    stats = cache.stats()
+    assert {k: stats[k] for k in ("entries", "memory_hits", "memory_misses", "disk_hits", "disk_misses", "evictions")} == {
+        "entries": 1, "memory_hits": 1, "memory_misses": 3, "disk_hits": 1, "disk_misses": 2, "evictions": 2,
+    }
+    assert sorted(os.listdir(tmp_path / "cache")) == sorted([os.path.basename(cache.entry_path(os.path.abspath(p))) for p in (a, b)])
+
+    #a new cache (as in a new process) finds both on disk without reading
+    #the sources, since they are much older than their entries
+    other = bytecode.ModuleCache(cache_dir=str(tmp_path / "cache"))
+    assert evaluate_cached(other, a) == 6 and evaluate_cached(other, b) == 3
+    entry_bytes = sum(os.path.getsize(os.path.join(tmp_path, "cache", name)) for name in os.listdir(tmp_path / "cache"))
+    assert other.stats()["disk_hits"] == 2
+    assert other.stats()["bytes_read"] == entry_bytes
+    assert other.stats()["bytes_written"] == 0
+
+
+def test_module_cache_racy_rewrite(tmp_path):
+    #a file changed within RACY_NS of being compiled can't be told apart by
+    #its size and mtime, so it is hashed until it is old enough
+    now = time.time_ns()
+    path = write_source(tmp_path / "racy.scm", "(+ 1 2)", now)
+    cache = bytecode.ModuleCache(cache_dir=str(tmp_path / "cache"))
+    assert evaluate_cached(cache, path) == 3
+    write_source(tmp_path / "racy.scm", "(+ 1 5)", now)
+    assert evaluate_cached(cache, path) == 6
+    assert cache.stats()["memory_misses"] == 2
+    assert evaluate_cached(bytecode.ModuleCache(cache_dir=str(tmp_path / "cache")), path) == 6
+
+    #once the mtime is well before the last check, the file isn't read again
+    old = now - 10 * bytecode.RACY_NS
+    os.utime(path, ns=(old, old))
+    assert evaluate_cached(cache, path) == 6
+    read = cache.stats()["bytes_read"]
+    assert evaluate_cached(cache, path) == 6
+    assert cache.stats()["bytes_read"] == read
+    assert cache.stats()["memory_hits"] == 2
+
+
+def test_module_cache_mtime_only_change(tmp_path):
+    old = time.time_ns() - 10 * bytecode.RACY_NS
+    path = write_source(tmp_path / "touched.scm", "(define (f x) (* x x)) (f 4)", old)
+    cache_dir = str(tmp_path / "cache")
+    assert evaluate_cached(bytecode.ModuleCache(cache_dir=cache_dir), path) == 16
+    entry_path = bytecode.ModuleCache(cache_dir=cache_dir).entry_path(os.path.abspath(path))
+    with open(entry_path, "rb") as f:
+        before = bytecode.ModuleEntry.from_bytes(f.read())
+
+    #touched: the hash matches, so the entry is used and saved with the new mtime
+    os.utime(path, ns=(old + 10**9, old + 10**9))
+    cache = bytecode.ModuleCache(cache_dir=cache_dir)
+    assert evaluate_cached(cache, path) == 16
+    assert (cache.stats()["disk_hits"], cache.stats()["disk_misses"]) == (1, 0)
+    assert cache.stats()["bytes_written"] > 0
+    with open(entry_path, "rb") as f:
+        after = bytecode.ModuleEntry.from_bytes(f.read())
+    assert after.mtime_ns == old + 10**9
+    assert after.digest == before.digest
+    assert after.checked_ns > before.checked_ns
+
+    #changed with the same size: the hash doesn't match
+    write_source(tmp_path / "touched.scm", "(define (f x) (+ x x)) (f 4)", old + 2 * 10**9)
+    cache = bytecode.ModuleCache(cache_dir=cache_dir)
+    assert evaluate_cached(cache, path) == 8
+    assert (cache.stats()["disk_hits"], cache.stats()["disk_misses"]) == (0, 1)
+
+
+@pytest.mark.parametrize("damage", [
+    lambda data: b"SCMB\x01" + data[len(bytecode.MAGIC):],
+    lambda data: data[:len(data) // 2],
+    lambda data: data[:len(bytecode.MAGIC)],
+    lambda data: bytecode.MAGIC + b"\x00" * 40,
+    lambda data: b"",
+])
+def test_module_cache_bad_entry(tmp_path, damage):
+    old = time.time_ns() - 10 * bytecode.RACY_NS
+    path = write_source(tmp_path / "m.scm", "(define (sq x) (* x x)) (sq 7)", old)
+    cache_dir = str(tmp_path / "cache")
+    cache = bytecode.ModuleCache(cache_dir=cache_dir)
+    assert evaluate_cached(cache, path) == 49
+    entry_path = cache.entry_path(os.path.abspath(path))
+    with open(entry_path, "rb") as f:
+        data = f.read()
+    with open(entry_path, "wb") as f:
+        f.write(damage(data))
+
+    #an entry from another version, or a damaged one, is compiled again
+    cache = bytecode.ModuleCache(cache_dir=cache_dir)
+    assert evaluate_cached(cache, path) == 49
+    assert (cache.stats()["disk_hits"], cache.stats()["disk_misses"]) == (0, 1)
+    with open(entry_path, "rb") as f:
+        assert f.read().startswith(bytecode.MAGIC)
+    assert evaluate_cached(bytecode.ModuleCache(cache_dir=cache_dir), path) == 49
@@ -12,13 +12,15 @@ sys.setrecursionlimit(10_000)
 
 def repl(raise_all=False):
     global_frame = None
+    # the lines of an expression that hasn't been closed yet
+    pending = ""
     while True:
         # read the input.  pressing ctrl+d exits, as does typing "EXIT" at the
         # prompt.  pressing ctrl+c moves on to the next prompt, ignoring
         # current input
         try:
-            inp = input("in> ")
-            if inp.strip().lower() == "exit":
+            inp = input("... " if pending else "in> ")
+            if not pending and inp.strip().lower() == "exit":
                 print("  bye bye!")
                 return
         except EOFError:
@@ -27,22 +29,31 @@ def repl(raise_all=False):
             return
         except KeyboardInterrupt:
             print()
+            pending = ""
             continue
 
+        # keep reading lines until every open paren has been closed
+        source = pending + inp + "\n"
+        tokens = tokenize(source)
+        if tokens.count("(") > tokens.count(")"):
+            pending = source
+            continue
+        pending = ""
+
         try:
-            # tokenize and parse the input
-            tokens = tokenize(inp)
-            ast = parse(tokens)
-            # if global_frame has not been set, we want to call
-            # result_and_frame without it (which will give us our new frame).
-            # if it has been set, though, we want to provide that value
-            # explicitly.
-            args = [ast]
-            if global_frame is not None:
-                args.append(global_frame)
-            result, global_frame = result_and_frame(*args)
-            # finally, print the result
-            print("  out> ", result)
+            # parse the input, which may hold any number of expressions, and
+            # evaluate them in turn
+            for ast in parse_all(source):
+                # if global_frame has not been set, we want to call
+                # result_and_frame without it (which will give us our new
+                # frame).  if it has been set, though, we want to provide
+                # that value explicitly.
+                args = [ast]
+                if global_frame is not None:
+                    args.append(global_frame)
+                result, global_frame = result_and_frame(*args)
+                # finally, print the result
+                print("  out> ", result)
         except SchemeError as e:
             # if raise_all was given as True, then we want to raise the
             # exception so we see a full traceback.  if not, just print some
@@ -111,6 +122,9 @@ def number_or_symbol(source):
     >>> number_or_symbol('source')
     'source'
     """
+    #a symbol starting with a letter can't be a number (unless it spells inf or nan)
+    if source[:1].isalpha() and source.lower() not in ('inf', 'nan', 'infinity'):
+        return source
     try:
         return int(source)
     except ValueError:
@@ -129,19 +143,24 @@ def tokenize(source):
         source (str): a string containing the source code of a Scheme
                       expression
     """
-    #character by character
-    result = ""
+    #line by line: drop the comment, pad the parens with spaces and split
+    tokens = []
+    for line in source.splitlines():
+        tokens.extend(line.split(';', 1)[0].replace('(', ' ( ').replace(')', ' ) ').split())
+    return tokens
 
-    for element in source.splitlines():
-        for character in element:
-            if character == '(' or character == ')':
-                result += f' {character} '
-            elif character == ";":
-                break
-            else:
-                result += character
-        result += " "
-    return result.split()
+def scan(source):
+    """
+    Generator that yields the same tokens as tokenize, one at a time, as
+    (token, line, column) tuples with 1-based line and column numbers.
+    """
+    for line_number, line in enumerate(source.splitlines(), 1):
+        line = line.split(';', 1)[0]
+        position = 0
+        for token in line.replace('(', ' ( ').replace(')', ' ) ').split():
+            position = line.find(token, position)
+            yield token, line_number, position + 1
+            position += len(token)
 
 operations = {
         "+": lambda args: sum(args),
@@ -161,19 +180,7 @@ def parse(tokens):
         raise SchemeSyntaxError("Unbalanced parenthesis")
     if tokens[0] != '(' and len(tokens) > 1:
         raise SchemeSyntaxError("Expression must start with an open parenthesis")
-    def parse_expression(tokens):
-        if tokens[0] == '(':
-            tokens.pop(0)
-            result = []
-            while tokens[0] != ')':
-                result.append(parse_expression(tokens))
-            tokens.pop(0)
-            return result
-        elif tokens[0] == ')':
-            raise SchemeSyntaxError("Unexpected ')'")
-        else:
-            return number_or_symbol(tokens.pop(0))
-    return parse_expression(tokens)
+    return next(parse_expressions(tokens))
 
     #     if tokens[0] == '(':
     #         tokens.pop(0)
@@ -190,25 +197,91 @@ def parse(tokens):
     #         return number_or_symbol(tokens.pop(0))
     # return parse_expression(tokens)
 
+def parse_expressions(tokens):
+    """
+    Generator that walks through the tokens once (without popping them off the
+    list) and yields each top-level expression as soon as it is complete.
+    Nested lists are kept on a stack rather than the Python call stack, so
+    deeply nested expressions can't hit the recursion limit.
+    """
+    #repeated tokens only go through number_or_symbol once
+    atoms = {}
+    stack = []
+    expression = []
+    for token in tokens:
+        if token == '(':
+            stack.append(expression)
+            expression = []
+        elif token == ')':
+            if not stack:
+                raise SchemeSyntaxError("Unexpected ')'")
+            done, expression = expression, stack.pop()
+            if stack:
+                expression.append(done)
+            else:
+                yield done
+                #so the cache doesn't grow forever on an endless stream
+                if len(atoms) > 10000:
+                    atoms.clear()
+        else:
+            atom = atoms.get(token)
+            if atom is None:
+                atom = atoms[token] = number_or_symbol(token)
+            if stack:
+                expression.append(atom)
+            else:
+                yield atom
+    if stack:
+        raise SchemeSyntaxError("Missing ')'")
+
+def parse_all(source):
+    """
+    Parses every top-level expression in a string of Scheme source code (e.g.
+    a whole file) and returns them as a list.  Syntax errors give the line and
+    column of the offending parenthesis.
+    """
+    try:
+        return list(parse_expressions(tokenize(source)))
+    except SchemeSyntaxError as e:
+        raise SchemeSyntaxError(f"{e} at {unbalanced_position(source)}") from None
+
+def unbalanced_position(source):
+    """
+    Returns 'line L, column C' for the first ')' without a matching '(' or,
+    if there isn't one, for the last top-level '(' that is never closed.
+    """
+    depth = 0
+    for token, line, column in scan(source):
+        if token == '(':
+            if depth == 0:
+                opened = line, column
+            depth += 1
+        elif token == ')':
+            depth -= 1
+            if depth < 0:
+                return f'line {line}, column {column}'
+    return 'line {}, column {}'.format(*opened)
+
 ######################
 # Built-in Functions #
 ######################
+#marks a name that is not bound in a frame or slot (None is a valid value)
+missing = object()
+
 class Frames():
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, bindings=None):
         self.parent = parent
         if not self.parent:
             self.parent = scheme_builtins
-        self.frame = {}
+        self.frame = {} if bindings is None else bindings
+        if bindings:
+            note_bindings(bindings)
     def __setitem__(self, key, value):
+        if key in special_forms:
+            rebound_special_forms.add(key)
         self.frame[key] = value
     def __getitem__(self, key):
-        if key in self.frame:
-            return self.frame[key]
-        else:
-            try:
-                return self.parent[key]
-            except:
-                raise SchemeNameError("Variable not found")
+        return lookup(self, key)
     def __repr__(self):
         return f'{self.frame}'
     def __contains__(self, item):
@@ -232,60 +305,268 @@ class Frames():
         else:
             return SchemeNameError("Item not in frame")
 
+class Scope():
+    """
+    The names bound in the frames of one function body or let, known at
+    compile time, in the order of their slots in a SlotFrame.  params are the
+    function's parameters (bound to the arguments of each call), and parent
+    is the Scope of the code the lambda or let appears in (None at the top
+    level, where frames are Frames looked up by name).
+    """
+    def __init__(self, names, parent=None, params=()):
+        self.parent = parent
+        self.params = params
+        self.names = []
+        self.index = {}
+        for name in list(params) + list(names):
+            if name not in self.index:
+                self.index[name] = len(self.names)
+                self.names.append(name)
+        note_bindings(self.names)
+        #with distinct parameters, the arguments are the first slots as is
+        self.simple = len(self.index) == len(self.names) and len(set(params)) == len(params)
+        self.padding = [missing] * (len(self.names) - len(params))
+    def resolve(self, name):
+        """
+        Returns (depth, slot): how many frames up name is bound and its slot
+        there, or (number of scopes, None) if none of them binds it (it is a
+        global or a builtin).
+        """
+        scope, depth = self, 0
+        while scope is not None:
+            slot = scope.index.get(name)
+            if slot is not None:
+                return depth, slot
+            scope, depth = scope.parent, depth + 1
+        return depth, None
+    def bind(self, items):
+        """
+        Returns the slots of a new frame with the parameters bound to items.
+        """
+        if self.simple:
+            return [*items, *self.padding]
+        slots = [missing] * len(self.names)
+        for name, item in zip(self.params, items):
+            slots[self.index[name]] = item
+        return slots
+
+class SlotFrame():
+    """
+    A frame for a function call or let compiled with a Scope: the value of
+    scope.names[i] is in slots[i] (missing until it is bound), so compiled
+    code finds it without searching by name.  Anything else bound in it (by
+    a helper evaluating code that wasn't compiled with the scope) goes in
+    the extra dictionary.  Supports the same by-name operations as Frames.
+    """
+    __slots__ = ('parent', 'scope', 'slots', 'extra')
+    def __init__(self, parent, scope, slots):
+        self.parent = parent
+        self.scope = scope
+        self.slots = slots
+        self.extra = None
+    def get_local(self, key):
+        slot = self.scope.index.get(key)
+        if slot is not None:
+            return self.slots[slot]
+        if self.extra is not None:
+            return self.extra.get(key, missing)
+        return missing
+    def bindings(self):
+        result = {name: value for name, value in zip(self.scope.names, self.slots)
+                  if value is not missing}
+        if self.extra:
+            result.update(self.extra)
+        return result
+    def __setitem__(self, key, value):
+        slot = self.scope.index.get(key)
+        if slot is not None:
+            self.slots[slot] = value
+        else:
+            if key in special_forms:
+                rebound_special_forms.add(key)
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+    def __getitem__(self, key):
+        return lookup(self, key)
+    def __repr__(self):
+        return f'{self.bindings()}'
+    def __contains__(self, item):
+        return self.get_local(item) is not missing or item in self.parent
+    def set_frame(self, item, eval):
+        if item not in self:
+            raise SchemeNameError
+        if self.get_local(item) is not missing:
+            self[item] = eval
+        else:
+            self.parent.set_frame(item, eval)
+    def get_frame(self, item):
+        value = self.get_local(item)
+        if value is not missing:
+            return value
+        return self.parent.get_frame(item)
+    def delete_item(self, key):
+        value = self.get_local(key)
+        if value is missing:
+            return SchemeNameError("Item not in frame")
+        slot = self.scope.index.get(key)
+        if slot is not None:
+            self.slots[slot] = missing
+        else:
+            del self.extra[key]
+        return value
+
+def lookup(frame, key):
+    """
+    Returns the value of key in frame or its parents (Frames and SlotFrames,
+    ending with a dictionary such as scheme_builtins), walking up the chain in
+    a loop rather than recursing through each parent.
+    """
+    while True:
+        if frame.__class__ is Frames:
+            value = frame.frame.get(key, missing)
+        elif frame.__class__ is SlotFrame:
+            value = frame.get_local(key)
+        else:
+            break
+        if value is not missing:
+            return value
+        frame = frame.parent
+    try:
+        return frame[key]
+    except KeyError:
+        raise SchemeNameError(f"Variable not found: {key}") from None
+
 class Function():
-    def __init__(self, args, body, frame):
+    def __init__(self, args, body, frame, code=None, scope=None):
         self.args = args
         self.body = body
         self.frame = frame
+        #body compiled by compile_expression (in tail position), done on the
+        #first call if not given
+        self.code = code
+        #the Scope the body was compiled with; None means its frames are
+        #Frames looked up by name
+        self.scope = scope
     def __call__(self, items):
-        if len(items) != len(self.args):
-            raise SchemeEvaluationError("Invalid number of arguments")
-        new_frame = Frames(self.frame)
-        for i in range(len(items)):
-            new_frame[self.args[i]] = items[i]
-        return evaluate(self.body, new_frame)
+        #calls in tail position come back as TailCalls and are run here in a
+        #loop, so tail-recursive functions don't grow the Python stack
+        function = self
+        while True:
+            if len(items) != len(function.args):
+                raise SchemeEvaluationError("Invalid number of arguments")
+            scope = function.scope
+            if scope is not None:
+                new_frame = SlotFrame(function.frame, scope, scope.bind(items))
+            else:
+                new_frame = Frames(function.frame, dict(zip(function.args, items)))
+                if function.code is None:
+                    function.code = compile_expression(function.body, True)
+            result = function.code(new_frame)
+            if result.__class__ is not TailCall:
+                return result
+            function, items = result.function, result.items
     def __repr__(self):
         return 'function'
 
+class TailCall():
+    """
+    A call to a Function made in tail position, returned instead of made so
+    that Function.__call__ can run it without going deeper.
+    """
+    __slots__ = ('function', 'items')
+    def __init__(self, function, items):
+        self.function = function
+        self.items = items
+
+def finish(result):
+    """
+    Runs result if it is a TailCall, for code compiled in tail position whose
+    value is needed right away.
+    """
+    if result.__class__ is TailCall:
+        return result.function(result.items)
+    return result
+
 class Pair():
+    """
+    A cons cell.  So that long lists don't need a Python object (or a Python
+    stack frame) per element, a Pair is a view into a list of cars: its car is
+    items[start], the items after it are the cars of the pairs that follow and
+    rest is the cdr of the last one.  cons makes a Pair holding one item, while
+    list and append put all their elements in one items list.  Pairs are never
+    changed once made, so views can share their items.
+
+    length is the number of elements in the list starting here (None if it
+    doesn't end in nil), so it never has to be counted.
+    """
+    __slots__ = ('items', 'start', 'rest', 'length')
     def __init__(self, car, cdr):
-        self.car = car
-        self.cdr = cdr
+        self.items = [car]
+        self.start = 0
+        self.rest = cdr
+        if isinstance(cdr, Pair):
+            self.length = None if cdr.length is None else cdr.length + 1
+        else:
+            self.length = 1 if isinstance(cdr, nil) else None
+    @staticmethod
+    def view(items, start, rest, length):
+        pair = Pair.__new__(Pair)
+        pair.items = items
+        pair.start = start
+        pair.rest = rest
+        pair.length = length
+        return pair
+    @property
+    def car(self):
+        return self.items[self.start]
+    @property
+    def cdr(self):
+        start = self.start + 1
+        if start == len(self.items):
+            return self.rest
+        return Pair.view(self.items, start, self.rest, None if self.length is None else self.length - 1)
     def get_car(self):
         return self.car
     def get_cdr(self):
         return self.cdr
-    def index_recurse(self, index):
-        if index == 0:
-            return self
-        try:
-            self.cdr.index_recurse(index - 1)
-        except:
-            raise SchemeEvaluationError("Index out of range")
-    def append_recurse(self, values):
-        if self.cdr == nil():
-            if values:
-                return Pair(self.car, values[0].append_recurse(values))
-            else:
-                return Pair(self.car, values[0])
-        try:
-            return Pair(self.car, self.cdr.append_recurse(values))
-        except:
-            raise SchemeEvaluationError('Recursion Error')
+    def elements(self):
+        """
+        Returns a Python list of the cars of this list and the cdr of its last
+        pair (nil for a proper list).
+        """
+        cars = []
+        pair = self
+        while isinstance(pair, Pair):
+            cars.extend(pair.items[pair.start:])
+            pair = pair.rest
+        return cars, pair
+    def index(self, index):
+        #skip a whole block of items at a time
+        pair = self
+        while isinstance(pair, Pair):
+            count = len(pair.items) - pair.start
+            if 0 <= index < count:
+                return pair.items[pair.start + index]
+            index -= count
+            pair = pair.rest
+        raise SchemeEvaluationError("Index out of range")
     def __len__(self):
-        if self.cdr == nil():
-            return 1
-        return 1 + len(self.cdr)
+        if self.length is None:
+            raise SchemeEvaluationError("Argument must be a linked-list")
+        return self.length
+    def __eq__(self, other):
+        #two views of the same place are the same pair
+        if not isinstance(other, Pair):
+            return NotImplemented
+        return self.items is other.items and self.start == other.start and self.rest is other.rest
+    def __hash__(self):
+        return hash((id(self.items), self.start))
     def __repr__(self):
-        return f'Pair({self.car}, {self.cdr})'
+        cars, last = self.elements()
+        return ''.join(f'Pair({car}, ' for car in cars) + f'{last}' + ')' * len(cars)
 
 class nil():  
-    def append_recursive(self, other):
-        if len(other) != 1:
-            return other[0].append_recursive(other[1:])
-        return other[0]
-    def index_recurse(self, index):
-        return SchemeEvaluationError("Index out of range")
     def __eq__(self, other):
         return isinstance(other, nil)
     def __repr__(self):
@@ -342,16 +623,15 @@ def cdr_helper(args):
     if len(args) != 1 or args[0] == nil() or not isinstance(args[0], Pair):
         raise SchemeEvaluationError
     return args[0].get_cdr()
-#can consider combining these two
 def create_list(args):
     if len(args) == 0 or not args:
         return nil()
-    return Pair(args[0], create_list(args[1:]))
+    return Pair.view(list(args), 0, nil(), len(args))
+def is_list(value):
+    return isinstance(value, nil) or (isinstance(value, Pair) and value.length is not None)
 def check_list(args):
-    if isinstance(args[0], nil):
+    if is_list(args[0]):
         return '#t'
-    elif isinstance(args[0], Pair):
-        return check_list([args[0].get_cdr()])
     return '#f'
 def length_helper(args):
     try:
@@ -361,23 +641,24 @@ def length_helper(args):
 def list_ref(args):
     if len(args) != 2:
         raise SchemeEvaluationError("List-ref takes two arguments")
-    try:
-        return args[0].index_recurse(args[1])
-    except:
+    if not isinstance(args[0], Pair) or not isinstance(args[1], int):
         raise SchemeEvaluationError("Index out of range")
+    return args[0].index(args[1])
 
 def append_helper(args):
     for element in args:
-        if type(element) != list:
+        if not is_list(element):
             raise SchemeEvaluationError("Arguments must be lists")
     if len(args) == 0:
         return nil()
-    if len(args) == 1:
-        return args[0]
-    if len(args) == 2:
-        return args[0] + args[1]
-    else:
-        return args[0].append_recursive(args[1:])
+    #the last list is shared rather than copied
+    items = []
+    for element in args[:-1]:
+        if isinstance(element, Pair):
+            items.extend(element.elements()[0])
+    if not items:
+        return args[-1]
+    return Pair.view(items, 0, args[-1], len(items) + len(args[-1]))
 def delete_helper(args, frame):
     return frame.delete_item(args[0])
 def let_helper(args, frame):
@@ -389,6 +670,17 @@ def let_helper(args, frame):
     return evaluate(args[1], new_frame)
 def set_helper(args, frame):
     return frame.set_frame(args[0], evaluate(args[1], frame))
+def comparison(holds):
+    """
+    Returns a builtin that gives '#t' if holds(a, b) for every pair of
+    neighboring arguments a, b and '#f' otherwise.
+    """
+    def compare(args):
+        for i in range(len(args) - 1):
+            if not holds(args[i], args[i+1]):
+                return '#f'
+        return '#t'
+    return compare
 
 scheme_builtins = {
     "+": lambda args: sum(args),
@@ -397,10 +689,10 @@ scheme_builtins = {
     "/": lambda args: 1 / args[0] if len(args) == 1 else (args[0] / mult(args[1:])),
     "**": lambda args: args[0] ** args[1],
     "equal?": lambda args: '#t' if all(arg == args[0] for arg in args) else '#f',
-    ">": lambda args: '#t' if all(args[i] > args[i+1] for i in range(len(args)-1)) else '#f',
-    "<": lambda args: '#t' if all(args[i] < args[i+1] for i in range(len(args)-1)) else '#f',
-    ">=": lambda args: '#t' if all(args[i] >= args[i+1] for i in range(len(args)-1)) else '#f',
-    "<=": lambda args: '#t' if all(args[i] <= args[i+1] for i in range(len(args)-1)) else '#f',
+    ">": comparison(lambda a, b: a > b),
+    "<": comparison(lambda a, b: a < b),
+    ">=": comparison(lambda a, b: a >= b),
+    "<=": comparison(lambda a, b: a <= b),
     "and": and_helper,
     "or": or_helper,
     "not": not_helper,
@@ -426,6 +718,321 @@ scheme_builtins = {
 
 special_forms =  ['lambda', 'define', 'and', 'or', 'if', 'del', 'let', 'set!']
 
+#the special forms whose names have been bound in some frame (or may be,
+#by a Scope), which compiled special forms have to look up before running;
+#see compile_special_form_guard
+rebound_special_forms = set()
+
+def note_bindings(names):
+    rebound_special_forms.update(name for name in names if name in special_forms)
+
+###############
+# Compilation #
+###############
+
+def compile_expression(tree, tail=False, scope=None):
+    """
+    Analyzes a parsed expression once and returns a function of a frame that
+    evaluates it, so that function bodies (e.g. loop bodies) are not
+    re-analyzed every time they run.  Special forms are resolved here;
+    malformed ones are left to their helpers in scheme_builtins at run time,
+    so they fail exactly like evaluate always has.
+
+    If tail is True, the expression is in tail position (its value is the
+    value of a function body), and the returned function gives a TailCall
+    instead of calling a Function; see Function.__call__.
+
+    scope is the Scope of the frames the code will run in, used to resolve
+    variables to slots (see compile_reference); None means the code runs in
+    frames that are looked up by name.
+    """
+    if tree == []:
+        def empty(frame):
+            raise SchemeEvaluationError("Empty expression")
+        return empty
+    if not isinstance(tree, list):
+        if isinstance(tree, str):
+            return compile_reference(tree, scope)
+        return lambda frame: tree
+    car, cdr = tree[0], tree[1:]
+    if car in special_forms:
+        compiler = special_form_compilers.get(car)
+        code = compiler(cdr, tail, scope) if compiler is not None else None
+        if code is None:
+            helper = scheme_builtins[car]
+            code = lambda frame: helper(cdr, frame)
+        return compile_special_form_guard(car, code, cdr, scope)
+    function_code = compile_expression(car, False, scope)
+    if tail:
+        return compile_tail_call(car, function_code, cdr, scope)
+    arg_codes = [compile_expression(element, False, scope) for element in cdr]
+    #calls with one or two arguments are by far the most common, so they
+    #skip building the argument list with a loop
+    if len(arg_codes) == 1:
+        arg0, = arg_codes
+        def call(frame):
+            function = function_code(frame)
+            if not callable(function):
+                raise SchemeEvaluationError("Cannot call non-function")
+            return function([arg0(frame)])
+    elif len(arg_codes) == 2:
+        arg0, arg1 = arg_codes
+        def call(frame):
+            function = function_code(frame)
+            if not callable(function):
+                raise SchemeEvaluationError("Cannot call non-function")
+            return function([arg0(frame), arg1(frame)])
+    else:
+        def call(frame):
+            function = function_code(frame)
+            if not callable(function):
+                raise SchemeEvaluationError("Cannot call non-function")
+            return function([arg(frame) for arg in arg_codes])
+    return call
+
+def compile_special_form_guard(name, code, args, scope):
+    """
+    Returns code that runs the compiled special form code only while name
+    still means the builtin special form.  A program can bind the name to
+    something else (e.g. (define and 5)), and then the expression is handled
+    like evaluate always has: the value is called with the unevaluated args
+    and the frame, or raises SchemeEvaluationError if it isn't callable.
+    Names that were never bound anywhere skip the lookup.
+    """
+    reference = compile_reference(name, scope)
+    helper = scheme_builtins[name]
+    rebound = rebound_special_forms
+    def special_form(frame):
+        if name not in rebound:
+            return code(frame)
+        value = reference(frame)
+        if value is helper:
+            return code(frame)
+        if not callable(value):
+            raise SchemeEvaluationError("Cannot call non-function")
+        return value(args, frame)
+    return special_form
+
+def compile_reference(name, scope):
+    """
+    Returns code that looks up a variable.  If the name was resolved to a
+    slot, the code goes straight to that frame's slot; an unbound slot (not
+    defined yet, or deleted) means the frame doesn't have the name, so the
+    lookup carries on by name from its parent, like in Frames.  Globals and
+    builtins skip the frames of the scopes and are looked up by name from
+    the first frame outside them.
+
+    Frames in between are only searched if something was bound in them
+    that isn't in their scope (see SlotFrame).
+    """
+    if scope is None:
+        return lambda frame: lookup(frame, name)
+    depth, slot = scope.resolve(name)
+    if slot is None and depth == 1:
+        def free(frame):
+            if frame.extra is not None and name in frame.extra:
+                return frame.extra[name]
+            return lookup(frame.parent, name)
+        return free
+    if slot is None:
+        def free(frame):
+            for _ in range(depth):
+                if frame.extra is not None and name in frame.extra:
+                    return frame.extra[name]
+                frame = frame.parent
+            return lookup(frame, name)
+        return free
+    if depth == 0:
+        def local(frame):
+            value = frame.slots[slot]
+            if value is missing:
+                return lookup(frame.parent, name)
+            return value
+        return local
+    def outer(frame):
+        for _ in range(depth):
+            if frame.extra is not None and name in frame.extra:
+                return frame.extra[name]
+            frame = frame.parent
+        value = frame.slots[slot]
+        if value is missing:
+            return lookup(frame.parent, name)
+        return value
+    return outer
+
+def compile_store(name, scope):
+    """
+    Returns a function of a frame and a value that binds name to the value in
+    that frame, in its slot if the scope has one for it.
+    """
+    slot = scope.index.get(name) if scope is not None and is_name(name) else None
+    if slot is None:
+        def store(frame, value):
+            frame[name] = value
+    else:
+        def store(frame, value):
+            frame.slots[slot] = value
+    return store
+
+def is_name(item):
+    return isinstance(item, (str, int, float))
+
+def defined_names(tree):
+    """
+    Returns the names that evaluating tree can define in the frame it runs
+    in: those of the define forms in it, except for the ones in lambdas, lets
+    and the bodies of functions defined with the short form, which run in
+    frames of their own.
+    """
+    names = []
+    def scan(tree):
+        if not isinstance(tree, list) or not tree:
+            return
+        car = tree[0]
+        if car == 'lambda' or car == 'let':
+            return
+        if car == 'define' and len(tree) > 2:
+            name = tree[1]
+            if isinstance(name, list):
+                if name and is_name(name[0]):
+                    names.append(name[0])
+                return
+            if is_name(name):
+                names.append(name)
+            scan(tree[2])
+            return
+        for element in tree:
+            scan(element)
+    scan(tree)
+    return names
+
+def compile_tail_call(car, function_code, args, scope):
+    if car == 'begin' and args:
+        #begin is a builtin, but the value of its last argument is the value
+        #of the whole expression, so that argument is in tail position
+        arg_codes = [compile_expression(arg, False, scope) for arg in args[:-1]]
+        last = compile_expression(args[-1], True, scope)
+    else:
+        arg_codes = [compile_expression(arg, False, scope) for arg in args]
+        last = None
+    begin = scheme_builtins['begin']
+    def tail_call(frame):
+        function = function_code(frame)
+        if not callable(function):
+            raise SchemeEvaluationError("Cannot call non-function")
+        items = [arg(frame) for arg in arg_codes]
+        if last is not None:
+            if function is begin:
+                return last(frame)
+            items.append(finish(last(frame)))
+        if function.__class__ is Function:
+            return TailCall(function, items)
+        return function(items)
+    return tail_call
+
+def compile_if(args, tail, scope):
+    if len(args) < 3:
+        return None
+    condition = compile_expression(args[0], False, scope)
+    true_code, false_code = (compile_expression(arg, tail, scope) for arg in args[1:3])
+    return lambda frame: true_code(frame) if condition(frame) == '#t' else false_code(frame)
+
+def compile_and(args, tail, scope):
+    codes = [compile_expression(arg, False, scope) for arg in args]
+    def and_code(frame):
+        for code in codes:
+            if code(frame) == '#f':
+                return '#f'
+        return '#t'
+    return and_code
+
+def compile_or(args, tail, scope):
+    codes = [compile_expression(arg, False, scope) for arg in args]
+    def or_code(frame):
+        for code in codes:
+            if code(frame) == '#t':
+                return '#t'
+        return '#f'
+    return or_code
+
+def compile_lambda(args, tail, scope):
+    if len(args) < 2:
+        return None
+    params, body = args[0], args[1]
+    if not isinstance(params, list) or not all(is_name(param) for param in params):
+        #odd parameters can't be given slots; Function handles them by name
+        return lambda frame: Function(params, body, frame)
+    body_scope = Scope(defined_names(body), scope, params)
+    code = compile_expression(body, True, body_scope)
+    return lambda frame: Function(params, body, frame, code, body_scope)
+
+def compile_define(args, tail, scope):
+    if len(args) < 2 or (isinstance(args[0], list) and not args[0]):
+        return None
+    name, body = args[0], args[1]
+    if isinstance(name, list):
+        name, params = name[0], name[1:]
+        make_function = compile_lambda([params, body], True, scope)
+        store = compile_store(name, scope)
+        def define_function(frame):
+            #define_helper wraps frame in an extra Frames, but nothing is ever
+            #bound in that one, so skipping it only saves a level per lookup
+            function = make_function(frame)
+            store(frame, function)
+            return function
+        return define_function
+    code = compile_expression(body, False, scope)
+    store = compile_store(name, scope)
+    def define_value(frame):
+        value = code(frame)
+        store(frame, value)
+        return value
+    return define_value
+
+def compile_del(args, tail, scope):
+    if not args:
+        return None
+    name = args[0]
+    return lambda frame: frame.delete_item(name)
+
+def compile_let(args, tail, scope):
+    if len(args) != 2 or not isinstance(args[0], list):
+        return None
+    if any(not isinstance(binding, list) or len(binding) < 2 or not is_name(binding[0])
+           for binding in args[0]):
+        return None
+    names = [binding[0] for binding in args[0]]
+    for binding in args[0]:
+        names.extend(defined_names(binding[1]))
+    let_scope = Scope(names + defined_names(args[1]), scope)
+    bindings = [(let_scope.index[binding[0]], compile_expression(binding[1], False, let_scope))
+                for binding in args[0]]
+    body = compile_expression(args[1], tail, let_scope)
+    def let_code(frame):
+        new_frame = SlotFrame(frame, let_scope, let_scope.bind(()))
+        slots = new_frame.slots
+        for slot, code in bindings:
+            slots[slot] = code(new_frame)
+        return body(new_frame)
+    return let_code
+
+def compile_set(args, tail, scope):
+    if len(args) < 2:
+        return None
+    name, code = args[0], compile_expression(args[1], False, scope)
+    return lambda frame: frame.set_frame(name, code(frame))
+
+special_form_compilers = {
+    'if': compile_if,
+    'and': compile_and,
+    'or': compile_or,
+    'lambda': compile_lambda,
+    'define': compile_define,
+    'del': compile_del,
+    'let': compile_let,
+    'set!': compile_set,
+}
+
 ##############
 # Evaluation #
 ##############
@@ -450,22 +1057,7 @@ def evaluate(tree, current_frame = None):
     """
     if current_frame is None:
         current_frame = Frames()
-        global_frame = Frames(current_frame)
-    if tree == []:
-        raise SchemeEvaluationError("Empty expression")
-    if not isinstance(tree, list):
-        return current_frame[tree] if isinstance(tree, str) else tree
-    # if isinstance(tree, list) and tree[0] not in current_frame:
-    #     return SchemeEvaluationError("Cannot redefine built-in function")
-    else:
-        car, cdr = tree[0], tree[1:]
-        arg = evaluate(car, current_frame)
-        if callable(arg):
-            if car in special_forms:
-                return arg(cdr, current_frame)
-            return arg([evaluate(element, current_frame) for element in cdr])
-        else:
-            raise SchemeEvaluationError("Cannot call non-function")
+    return compile_expression(tree)(current_frame)
 
     # # raise SchemeEvaluationError
     # if current_frame is None:
@@ -504,16 +1096,54 @@ def evaluate(tree, current_frame = None):
     #             return evaluate(tree[3], current_frame)
     #     return evaluate(tree[0], current_frame)([evaluate(item, current_frame) for item in tree[1:]])
 
+class FormReader():
+    """
+    Reads the top-level expressions of Scheme source from a file-like object
+    (anything that gives lines of text when iterated over, such as an open
+    file or sys.stdin) one at a time, so only the lines of the expression
+    being read are held in memory.  line is the number of lines read so far.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.line = 0
+    def tokens(self):
+        for line in self.stream:
+            self.line += 1
+            yield from tokenize(line)
+    def __iter__(self):
+        try:
+            yield from parse_expressions(self.tokens())
+        except SchemeSyntaxError as e:
+            raise SchemeSyntaxError(f"{e} (reading line {self.line})") from None
+
+def evaluate_stream(stream, current_frame = None):
+    """
+    Generator that reads the expressions from a file-like object one at a
+    time (see FormReader), evaluates each in turn in the same frame and
+    yields its result.
+
+    Arguments:
+        stream: an open file, sys.stdin, io.StringIO, etc.
+    """
+    if current_frame is None:
+        current_frame = Frames()
+    for tree in FormReader(stream):
+        yield evaluate(tree, current_frame)
+
 def evaluate_file(file_name, current_frame = None):
     """
     Evaluate the given file according to the rules of the Scheme
-    language.
+    language.  Every expression in the file is evaluated in turn, and the
+    value of the last one is returned.
 
     Arguments:
         file_name (str): the name of the file to evaluate
     """
+    result = None
     with open(file_name) as f:
-        return evaluate(parse(tokenize(f.read())), current_frame)
+        for result in evaluate_stream(f, current_frame):
+            pass
+    return result
 
 if __name__ == "__main__":
     # code in this block will only be executed if lab.py is the main file being
@@ -522,7 +1152,19 @@ if __name__ == "__main__":
     # uncommenting the following line will run doctests from above
     # doctest.testmod()
 
-    repl()
+    # with arguments, evaluate those files ("-" for stdin) and print each
+    # result; otherwise, start the REPL
+    if sys.argv[1:]:
+        for file_name in sys.argv[1:]:
+            if file_name == "-":
+                for result in evaluate_stream(sys.stdin):
+                    print(result)
+                continue
+            with open(file_name) as stream:
+                for result in evaluate_stream(stream):
+                    print(result)
+    else:
+        repl()
     # print(evaluate(3.14))
     # print(evaluate(['*', 3, 7, 2]))
     # print(evaluate(['*', 3, ['*', 7, 5]]))
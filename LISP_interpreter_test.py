@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import io
 import os
 import lab
 import sys
@@ -526,6 +527,184 @@ def test_sudoku_solver():
     do_raw_continued_evaluations(66)
 
 
+def test_compiled_evaluation():
+    program = [
+        "(define (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))",
+        "(fib 15)",
+        "(fib 1 2)",
+        "(let ((a 1) (b (+ a 1))) (* a b))",
+        "(and #t (undefined))",
+        "(if (or #t (undefined)) 1 2)",
+        "(1 2)",
+        "()",
+    ]
+    results = run_continued_evaluations([lab.parse(lab.tokenize(i)) for i in program])
+    assert [r["output"] if r["ok"] else r["type"] for r in results] == [
+        "SOMETHING",
+        610,
+        "SchemeEvaluationError",
+        2,
+        "SchemeNameError",
+        1,
+        "SchemeEvaluationError",
+        "SchemeEvaluationError",
+    ]
+
+
+def test_rebound_special_forms():
+    #a special form whose name is bound to something else is called like any
+    #other value, even from code compiled before the name was bound
+    program = [
+        "(define (f) (and #t #f))",
+        "(f)",
+        "(define and 5)",
+        "(and 1 2)",
+        "(f)",
+        "(define (g or) (or #t #t))",
+        "(g 3)",
+        "(or #f #t)",
+        "(define (h x) (let ((if 3)) (if x 1 2)))",
+        "(h #t)",
+        "(if #t 1 2)",
+    ]
+    #the frames binding these names are thrown away after the test, so
+    #forget them and let later tests skip looking the names up
+    rebound = set(lab.rebound_special_forms)
+    try:
+        results = run_continued_evaluations([lab.parse(lab.tokenize(i)) for i in program])
+        assert [r["output"] if r["ok"] else r["type"] for r in results] == [
+            "SOMETHING",
+            "SOMETHING",
+            5,
+            "SchemeEvaluationError",
+            "SchemeEvaluationError",
+            "SOMETHING",
+            "SchemeEvaluationError",
+            "SOMETHING",
+            "SOMETHING",
+            "SchemeEvaluationError",
+            1,
+        ]
+    finally:
+        lab.rebound_special_forms.intersection_update(rebound)
+
+
+def test_tail_calls():
+    program = [
+        "(define (loop n acc) (if (equal? n 0) acc (loop (- n 1) (+ acc 1))))",
+        "(loop 50000 0)",
+        "(define (even? n) (if (equal? n 0) 1 (odd? (- n 1))))",
+        "(define (odd? n) (if (equal? n 0) 0 (let ((m (- n 1))) (begin m (even? m)))))",
+        "(even? 30001)",
+    ]
+    results = run_continued_evaluations([lab.parse(lab.tokenize(i)) for i in program])
+    assert [r["output"] for r in results] == ["SOMETHING", 50000, "SOMETHING", "SOMETHING", 0]
+
+
+def test_lexical_addressing():
+    program = [
+        "(define x 1)",
+        "(define (f x) (begin (del x) x))",
+        "(f 5)",
+        "(define (g c) (begin (if (equal? c 1) (define y 5) 0) y))",
+        "(g 1)",
+        "(g 0)",
+        "(define (mk a) (lambda (b) (let ((c 3)) (lambda (d) (+ a b c d x)))))",
+        "(((mk 10) 20) 40)",
+        "(define (counter) (let ((n 0)) (lambda () (begin (set! n (+ n 1)) n))))",
+        "(define tick (counter))",
+        "(tick)",
+        "(tick)",
+    ]
+    results = run_continued_evaluations([lab.parse(lab.tokenize(i)) for i in program])
+    assert [r["output"] if r["ok"] else r["type"] for r in results] == [
+        1,
+        "SOMETHING",
+        1,
+        "SOMETHING",
+        5,
+        "SchemeNameError",
+        "SOMETHING",
+        74,
+        "SOMETHING",
+        "SOMETHING",
+        1,
+        2,
+    ]
+
+
+def test_parse_all():
+    source = "(define x 1) ; first\n5\n(+ x\n   (* 2 3))"
+    assert lab.parse_all(source) == [["define", "x", 1], 5, ["+", "x", ["*", 2, 3]]]
+    assert [t for t, line, column in lab.scan(source)] == lab.tokenize(source)
+    assert list(lab.scan("(a\n  bc)"))[2:] == [("bc", 2, 3), (")", 2, 5)]
+
+    #deep nesting doesn't hit the recursion limit
+    deep = "(" * 50000 + ")" * 50000
+    assert lab.parse_all(deep) != []
+
+    for source, position in [("(a))", "line 1, column 4"), ("(a)\n(b (c)", "line 2, column 1")]:
+        with pytest.raises(lab.SchemeSyntaxError) as e:
+            lab.parse_all(source)
+        assert position in str(e.value)
+
+
+def test_long_lists():
+    program = [
+        "(define (build n acc) (if (equal? n 0) acc (build (- n 1) (cons n acc))))",
+        #(the test helpers convert lists recursively, so don't return the long ones)
+        "(begin (define big (build 100000 nil)) 0)",
+        "(length big)",
+        "(list-ref big 99999)",
+        "(list? big)",
+        "(begin (define both (append (list 1 2) (cons 3 nil) big)) 0)",
+        "(length both)",
+        "(list-ref both 2)",
+        "(list-ref both 100002)",
+        "(list-ref both 100003)",
+        "(append (list 1 2) (list 3))",
+        "(cdr (cdr (list 1 2 3)))",
+        "(length (cons 1 2))",
+        "(append (list 1) 2)",
+    ]
+    results = run_continued_evaluations([lab.parse(lab.tokenize(i)) for i in program])
+    assert [r["output"] if r["ok"] else r["type"] for r in results] == [
+        "SOMETHING",
+        0,
+        100000,
+        100000,
+        "SOMETHING",
+        0,
+        100003,
+        3,
+        100000,
+        "SchemeEvaluationError",
+        [1, 2, 3],
+        [3],
+        "SchemeEvaluationError",
+        "SchemeEvaluationError",
+    ]
+
+
+def test_evaluate_stream():
+    source = "(define x 1) ; first\n(+ x\n   2)\n5 (define (f n) (* n 10)) (f x)\n"
+    results = lab.evaluate_stream(io.StringIO(source))
+    assert [list_from_ll(r) for r in results] == [1, 3, 5, "SOMETHING", 10]
+
+    #results come one at a time, before later expressions are even read
+    results = lab.evaluate_stream(io.StringIO("(+ 1 2)\n(car nil)\n)"))
+    assert next(results) == 3
+    with pytest.raises(lab.SchemeEvaluationError):
+        next(results)
+
+    with pytest.raises(lab.SchemeSyntaxError) as e:
+        list(lab.evaluate_stream(io.StringIO("(+ 1 2)\n(+ 1\n2))\n")))
+    assert "line 3" in str(e.value)
+
+    lines = ("(define v%d (* %d %d))\n" % (i % 10, i, i) for i in range(20000))
+    assert sum(1 for _ in lab.evaluate_stream(lines)) == 20000
+
+
 if __name__ == "__main__":
     import sys
 
@@ -1,13 +1,117 @@
 #!/usr/bin/env python3
 
-# NO ADDITIONAL IMPORTS!
-# (except in the last part of the lab; see the lab writeup for details)
+# Imports are limited to the standard library and PIL, plus NumPy when it is
+# installed; everything that uses NumPy has a pure Python fallback, so the
+# module still works without it.
 from cmath import inf
 import math
+import os
 from turtle import color
 from webbrowser import get
+from itertools import accumulate, chain
+from array import array
+from functools import wraps, partial, lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
 from PIL import Image
 
+try:
+    import numpy
+except ImportError:  # the pure Python correlation engine is used instead
+    numpy = None
+
+
+# COMPACT IMAGES
+
+class CompactImage:
+    """
+    An image whose pixels live in flat arrays instead of a list of Python
+    objects.  Greyscale images have one plane and color images have three
+    (red, green, blue), each a row-major array of width*height values.  Planes
+    are array('B') when every value is an integer in [0, 255] and array('d')
+    otherwise (e.g. unrounded correlation results).
+    """
+    def __init__(self, width, height, planes):
+        self.width = width
+        self.height = height
+        self.planes = list(planes)
+
+    @property
+    def is_color(self):
+        return len(self.planes) == 3
+
+    @property
+    def nbytes(self):
+        """Number of bytes used by the pixel planes."""
+        return sum(len(plane) * plane.itemsize for plane in self.planes)
+
+    @classmethod
+    def from_dict(cls, image, color=False):
+        """
+        Builds a compact image from a dictionary with 'height', 'width' and
+        'pixels' keys (greyscale values or RGB tuples).  An image without
+        pixels can't tell which it is, so it is a color image if color is
+        True and a greyscale one otherwise.
+        """
+        pixels = image['pixels']
+        if pixels and isinstance(pixels[0], tuple):
+            channels = zip(*pixels)
+        elif not pixels and color:
+            channels = [[], [], []]
+        else:
+            channels = [pixels]
+        return cls(image['width'], image['height'],
+                   [make_plane(channel) for channel in channels])
+
+    def to_dict(self):
+        """
+        Returns the dictionary representation used by the rest of the lab.
+        """
+        if self.is_color:
+            pixels = list(zip(*self.planes))
+        else:
+            pixels = self.planes[0].tolist()
+        return {'height': self.height, 'width': self.width, 'pixels': pixels}
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactImage):
+            return NotImplemented
+        return (self.width, self.height, self.planes) == (other.width, other.height, other.planes)
+
+    def __repr__(self):
+        kind = 'color' if self.is_color else 'greyscale'
+        return f'CompactImage({self.width}x{self.height}, {kind})'
+
+
+def make_plane(values):
+    """
+    Packs a sequence of pixel values into a byte array if they are all
+    integers in [0, 255], and into an array of doubles otherwise.
+    """
+    try:
+        return array('B', values)
+    except (TypeError, OverflowError):
+        return array('d', values)
+
+
+def compact_aware(filt):
+    """
+    Decorator for filters written against the dictionary representation: a
+    CompactImage argument is converted on the way in, and the result is
+    converted back so callers get the same kind of image they passed.
+
+    So while such a filter runs, the image is a list of Python objects (one
+    per pixel, or one tuple per pixel for color images) like any dictionary
+    image: compact images only save memory between filters.  (inverted and
+    greyscale_image_from_color_image work on the planes directly.)
+    """
+    @wraps(filt)
+    def wrapper(image, *args, **kwargs):
+        if isinstance(image, CompactImage):
+            return CompactImage.from_dict(filt(image.to_dict(), *args, **kwargs), image.is_color)
+        return filt(image, *args, **kwargs)
+    return wrapper
+
 
 # VARIOUS FILTERS
 #lab 1 stuff!
@@ -51,7 +155,48 @@ def set_pixel(image, x, y, c):
     index = image['width']*(y)+(x)
     image['pixels'][index] = c
 
-def apply_per_pixel(image, func):
+def point_table(func, values=range(256)):
+    """
+    Returns (table, translation) for a per-pixel function, where table[c] is
+    func(c) for every 8-bit value c in values (0 for the others) and
+    translation is the same table as a bytes object for bytes.translate
+    (None if some output is not in 0-255).
+    """
+    table = [0]*256
+    for c in values:
+        table[c] = func(c)
+    try:
+        translation = bytes(table)
+    except (TypeError, ValueError):
+        translation = None
+    return table, translation
+
+@lru_cache(maxsize=64)
+def cached_point_table(func):
+    """
+    point_table of all 256 values, cached by function.  Only for functions
+    that live as long as the module and always give the same result (like
+    invert_value): the cache keeps them alive and never calls them again.
+    """
+    return point_table(func)
+
+def apply_per_pixel(image, func, table=None):
+    #8-bit pixels can only take 256 values, so look them up in a table
+    #instead of calling func on every pixel.  table can be passed in (from
+    #cached_point_table); otherwise it only covers the values in the image,
+    #so func is only called on values it would have been called on anyway
+    try:
+        data = bytes(image['pixels'])
+    except (TypeError, ValueError):
+        #not 8-bit pixels: call func pixel by pixel
+        data = None
+    if data is not None:
+        table, translation = table or point_table(func, set(data))
+        if translation is not None:
+            pixels = list(data.translate(translation))
+        else:
+            pixels = [table[c] for c in data]
+        return {'height': image['height'], 'width': image['width'], 'pixels': pixels}
     result = {
         'height': image['height'],
         'width': image['width'],
@@ -65,16 +210,110 @@ def apply_per_pixel(image, func):
             set_pixel(result, x, y, newcolor)
     return result
 
+def invert_value(c):
+    return 255-c
+
 def inverted(image):
-    return apply_per_pixel(image, lambda c: 255-c)
+    if isinstance(image, CompactImage):
+        #8-bit planes are translated as bytes, without a list of pixels
+        table, translation = cached_point_table(invert_value)
+        planes = [array('B', plane.tobytes().translate(translation)) if plane.typecode == 'B'
+                  else make_plane([invert_value(c) for c in plane])
+                  for plane in image.planes]
+        return CompactImage(image.width, image.height, planes)
+    return apply_per_pixel(image, invert_value, cached_point_table(invert_value))
+
+#lets filter_cascade fuse inverted with neighboring per-pixel operations
+inverted.point_function = invert_value
 
 def get_coordinates(image, pixel_index):
     y_value = int((pixel_index)/image['width'])
     x_value = ((pixel_index) % image['width'])
     return x_value, y_value
 
+@compact_aware
 def correlate(image, kernel, boundary_behavior):
+    """
+    Correlates a greyscale image with a square kernel (a flat row-major list)
+    using the given boundary behavior ('zero', 'wrap' or 'extend').
+
+    The image is padded once up front, and the output is accumulated one
+    kernel tap at a time over whole rows, in the same order as
+    correlate_by_pixel so the results (and their int/float types) are
+    identical.  NumPy is used when it is installed and the image is all floats,
+    or all ints small enough that no partial sum leaves the range where int64
+    and float64 are exact.  Kernels without an odd integer side length, and
+    unknown boundary behaviors, fall back to correlate_by_pixel.
+    """
+    size = math.isqrt(len(kernel))
+    if (size*size != len(kernel) or size % 2 == 0 or not image['pixels']
+            or boundary_behavior not in ('zero', 'wrap', 'extend')):
+        return correlate_by_pixel(image, kernel, boundary_behavior)
+    width, height = image['width'], image['height']
+    padded = padded_rows(image, size // 2, boundary_behavior)
+    if numpy is not None and numpy_correlates_exactly(image['pixels'], kernel):
+        source = numpy.array(padded)
+        weights = numpy.array(kernel)
+        result = numpy.zeros((height, width), numpy.result_type(source, weights))
+        for index, weight in enumerate(kernel):
+            dy, dx = divmod(index, size)
+            result += weight * source[dy:dy+height, dx:dx+width]
+        new_values = result.ravel().tolist()
+    else:
+        new_values = []
+        for y in range(height):
+            row = [0]*width
+            for index, weight in enumerate(kernel):
+                dy, dx = divmod(index, size)
+                source = padded[y+dy][dx:dx+width]
+                row = [total + weight*value for total, value in zip(row, source)]
+            new_values.extend(row)
+    return {
+            'height': height,
+            'width': width,
+            'pixels': new_values
+    }
 
+def numpy_correlates_exactly(pixels, kernel):
+    """
+    Returns whether correlating pixels with kernel in NumPy gives the same
+    values and types as in Python: the pixels must be all floats (float64 is
+    what Python uses), or all ints whose weighted sums stay below 2**53, so
+    int64 can't overflow and mixing in float weights rounds nothing.  Images
+    mixing ints and floats are left to Python, where each output pixel is an
+    int or a float depending on its own neighborhood.
+    """
+    kinds = set(map(type, pixels))
+    if kinds == {float}:
+        return True
+    if kinds != {int}:
+        return False
+    return max(map(abs, pixels)) * sum(map(abs, kernel)) < 2**53
+
+def padded_rows(image, radius, boundary_behavior):
+    """
+    Returns the rows of a greyscale image as lists, padded by radius pixels on
+    every side according to the boundary behavior, so that padded[y+radius]
+    [x+radius] == get_pixel(image, x, y, boundary_behavior) for every x and y
+    within radius of the image.
+    """
+    width, height = image['width'], image['height']
+    pixels = image['pixels']
+    rows = [list(pixels[y*width:(y+1)*width]) for y in range(height)]
+    if boundary_behavior == 'zero':
+        padded = [[0]*radius + row + [0]*radius for row in rows]
+        blank = [0]*(width + 2*radius)
+        return [blank]*radius + padded + [blank]*radius
+    if boundary_behavior == 'wrap':
+        padded = [[row[x % width] for x in range(-radius, width + radius)] for row in rows]
+        return [padded[y % height] for y in range(-radius, height + radius)]
+    padded = [[row[0]]*radius + row + [row[-1]]*radius for row in rows]
+    return [padded[min(max(y, 0), height-1)] for y in range(-radius, height + radius)]
+
+def correlate_by_pixel(image, kernel, boundary_behavior):
+    """
+    Reference correlation that looks up every kernel tap with get_pixel.
+    """
     kernel_dimension = len(kernel)**(1/2)
     kernel_range = int((kernel_dimension-1)/2)
     new_values = []
@@ -113,20 +352,72 @@ def round_and_clip_image(image):
             image['pixels'][i] = round(image['pixels'][i])
     return image
 
-def blur_kernel_creator(n):
+@lru_cache(maxsize=32)
+def cached_kernel(kind, n):
+    """
+    Returns the n-by-n 'blur' or 'sharpen' kernel as a tuple.  Kernels are
+    memoized by (kind, n); callers that change them must copy them first.
+    """
     kernel_size = n**2
-    kernel_entry = 1/kernel_size
-    kernel = []
-    for i in range(0, kernel_size):
-        kernel.append(kernel_entry)
-    return kernel
+    kernel = [1/kernel_size]*kernel_size
+    if kind == 'sharpen':
+        #2*image - blurred(image) as a single kernel
+        kernel = [-k for k in kernel]
+        kernel[kernel_size//2] += 2
+    elif kind != 'blur':
+        raise ValueError(f'unknown kernel type: {kind!r}')
+    return tuple(kernel)
 
+def blur_kernel_creator(n):
+    return list(cached_kernel('blur', n))
+
+def box_sums(image, n):
+    """
+    Given a greyscale image of integers and an odd kernel size n, returns a
+    list with the sum of the n-by-n neighborhood around every pixel (using the
+    'extend' boundary behavior).  The sums are computed with two separable
+    running-sum passes (rows, then columns), so the cost per pixel does not
+    depend on n.  They are only exact for integer pixels: with floats, adding
+    and subtracting the same values does not always cancel out.
+    """
+    width, height = image['width'], image['height']
+    radius = n // 2
+    pixels = image['pixels']
+    #horizontal pass: prefix sums over each row padded by repeating the edges
+    row_sums = []
+    for y in range(height):
+        row = list(pixels[y*width:(y+1)*width])
+        padded = [row[0]]*radius + row + [row[-1]]*radius
+        prefix = list(accumulate(padded, initial=0))
+        row_sums.append([prefix[x+n] - prefix[x] for x in range(width)])
+    #vertical pass: slide an n-row window down the padded column sums
+    padded_rows = [row_sums[0]]*radius + row_sums + [row_sums[-1]]*radius
+    window = [sum(column) for column in zip(*padded_rows[:n])]
+    sums = list(window)
+    for y in range(1, height):
+        window = [w + entering - leaving for w, entering, leaving
+                  in zip(window, padded_rows[y+n-1], padded_rows[y-1])]
+        sums.extend(window)
+    return sums
+
+@compact_aware
 def blurred(image, n):
+    if (n > 0 and n % 2 == 1 and image['pixels']
+            and all(type(value) is int for value in image['pixels'])):
+        #box kernels only need the neighborhood sums; dividing the exact sum
+        #once rounds to the same values as correlating with 1/n**2 weights
+        #(n**2 is odd, so an integer sum is never halfway between two values)
+        area = n**2
+        correlated = {'height': image['height'],
+                      'width': image['width'],
+                      'pixels': [s / area for s in box_sums(image, n)]}
+        return round_and_clip_image(correlated)
     kernel = blur_kernel_creator(n)
     correlated = correlate(image, kernel, 'extend')
     final_blur = round_and_clip_image(correlated)
     return final_blur
 
+@compact_aware
 def sharpened(image, n):
     blur = blurred(image, n)
     new_image = {'height': image['height'],
@@ -143,7 +434,73 @@ def sharpened(image, n):
     final_sharpened = round_and_clip_image(new_image)
     return final_sharpened
 
+@compact_aware
 def edges(image):
+    """
+    Applies the Sobel operator, returning the rounded and clipped gradient
+    magnitude of every pixel ('extend' boundary behavior).
+
+    For 8-bit images both gradients and the magnitude are computed in a
+    single pass with sobel_rows; other images go through
+    edges_by_correlation.  Both give identical results.
+    """
+    width, height = image['width'], image['height']
+    plane = make_plane(image['pixels'])
+    if plane.typecode != 'B' or not plane:
+        return edges_by_correlation(image)
+    rows = [plane[y*width:(y+1)*width].tolist() for y in range(height)]
+    return {'height': height,
+            'width': width,
+            'pixels': [value for row in sobel_rows(rows) for value in row]}
+
+def sobel_rows(rows):
+    """
+    Given a greyscale image of integers as a list of rows, returns the rows of
+    edges() of that image.
+
+    The Sobel kernels are separable: the x kernel is a [1, 2, 1] column
+    smoothing of [-1, 0, 1] row differences, and the y kernel is a [-1, 0, 1]
+    column difference of [1, 2, 1] row smoothings.  So each row is
+    differenced and smoothed once, and each output row combines the results
+    for the rows above, at and below it.  Integer sums are exact, so the
+    order of the additions does not matter.
+    """
+    height = len(rows)
+    if numpy is not None:
+        return sobel_array(numpy.array(rows, numpy.int64)).tolist()
+    differences, smoothed = [], []
+    for row in rows:
+        padded = [row[0]] + row + [row[-1]]
+        differences.append([right - left for left, right in zip(padded, padded[2:])])
+        smoothed.append([left + 2*middle + right
+                         for left, middle, right in zip(padded, padded[1:], padded[2:])])
+    result = []
+    for y in range(height):
+        above, below = max(y-1, 0), min(y+1, height-1)
+        result.append([min(round((ox**2 + oy**2)**(1/2)), 255)
+                       for ox, oy in zip(
+                           [a + 2*b + c for a, b, c in
+                            zip(differences[above], differences[y], differences[below])],
+                           [b - a for a, b in zip(smoothed[above], smoothed[below])])])
+    return result
+
+def sobel_array(grey):
+    """
+    The NumPy path of sobel_rows: given a greyscale image as a 2D integer
+    array, returns edges() of it as a 2D int64 array.
+    """
+    padded = numpy.pad(grey.astype(numpy.int64), 1, mode='edge')
+    differences = padded[:, 2:] - padded[:, :-2]
+    smoothed = padded[:, :-2] + 2*padded[:, 1:-1] + padded[:, 2:]
+    ox = differences[:-2] + 2*differences[1:-1] + differences[2:]
+    oy = smoothed[2:] - smoothed[:-2]
+    magnitudes = numpy.rint(numpy.sqrt(ox*ox + oy*oy))
+    return numpy.minimum(magnitudes, 255).astype(numpy.int64)
+
+def edges_by_correlation(image):
+    """
+    Reference Sobel operator built from two calls to correlate.
+    """
     x_kernel = [-1, 0, 1, -2, 0, 2, -1, 0, 1]
     y_kernel = [-1, -2, -1, 0, 0, 0, 1, 2, 1]
     ox = correlate(image, x_kernel, 'extend')
@@ -160,10 +517,11 @@ def edges(image):
 # HELPER FUNCTIONS FOR LOADING AND SAVING COLOR IMAGES
 
 
-def load_color_image(filename):
+def load_color_image(filename, compact=False):
     """
     Loads a color image from the given file and returns a dictionary
-    representing that image.
+    representing that image.  If compact is True, returns a CompactImage
+    instead.
 
     Invoked as, for example:
        i = load_color_image('test_images/cat.png')
@@ -171,10 +529,11 @@ def load_color_image(filename):
     with open(filename, "rb") as img_handle:
         img = Image.open(img_handle)
         img = img.convert("RGB")  # in case we were given a greyscale image
-        img_data = img.getdata()
-        pixels = list(img_data)
+        planes = color_planes(img)
         w, h = img.size
-        return {"height": h, "width": w, "pixels": pixels}
+        if compact:
+            return CompactImage(w, h, planes)
+        return {"height": h, "width": w, "pixels": list(zip(*planes))}
 
 
 def save_color_image(image, filename, mode="PNG"):
@@ -184,8 +543,13 @@ def save_color_image(image, filename, mode="PNG"):
     If filename is given as a file-like object, the file type will be
     determined by the 'mode' parameter.
     """
-    out = Image.new(mode="RGB", size=(image["width"], image["height"]))
-    out.putdata(image["pixels"])
+    if not isinstance(image, CompactImage):
+        image = compact_if_bytes(image)
+    if isinstance(image, CompactImage):
+        out = image_from_planes("RGB", image)
+    else:
+        out = Image.new(mode="RGB", size=(image["width"], image["height"]))
+        out.putdata(image["pixels"])
     if isinstance(filename, str):
         out.save(filename)
     else:
@@ -193,29 +557,91 @@ def save_color_image(image, filename, mode="PNG"):
     out.close()
 
 
-def load_greyscale_image(filename):
+def load_greyscale_image(filename, compact=False):
     """
     Loads an image from the given file and returns an instance of this class
-    representing that image.  This also performs conversion to greyscale.
+    representing that image.  This also performs conversion to greyscale.  If
+    compact is True, returns a CompactImage instead of a dictionary.
 
     Invoked as, for example:
        i = load_greyscale_image('test_images/cat.png')
     """
     with open(filename, "rb") as img_handle:
         img = Image.open(img_handle)
-        img_data = img.getdata()
-        if img.mode.startswith("RGB"):
-            pixels = [
-                round(0.299 * p[0] + 0.587 * p[1] + 0.114 * p[2]) for p in img_data
-            ]
-        elif img.mode == "LA":
-            pixels = [p[0] for p in img_data]
-        elif img.mode == "L":
-            pixels = list(img_data)
-        else:
-            raise ValueError("Unsupported image mode: %r" % img.mode)
+        plane = greyscale_plane(img)
         w, h = img.size
-        return {"height": h, "width": w, "pixels": pixels}
+        if compact:
+            return CompactImage(w, h, [plane])
+        return {"height": h, "width": w, "pixels": plane.tolist()}
+
+
+def color_planes(img):
+    """
+    Returns the red, green and blue planes of an RGB PIL image, sliced
+    straight out of its raw bytes.
+    """
+    raw = img.tobytes()
+    return [array('B', raw[c::3]) for c in range(3)]
+
+
+def greyscale_plane(img):
+    """
+    Returns the pixels of a PIL image as a byte plane of greyscale values,
+    converting color images with round(0.299*r + 0.587*g + 0.114*b).  The
+    conversion is done with NumPy when it is installed; either way the
+    channels are sliced out of the raw bytes rather than read pixel by pixel.
+    """
+    raw = img.tobytes()
+    step = len(img.getbands())
+    if img.mode.startswith("RGB"):
+        r, g, b = raw[0::step], raw[1::step], raw[2::step]
+        if numpy is not None:
+            r, g, b = (numpy.frombuffer(channel, numpy.uint8) for channel in (r, g, b))
+            grey = numpy.rint(0.299 * r + 0.587 * g + 0.114 * b).astype(numpy.uint8)
+            return array('B', grey.tobytes())
+        return array('B', [round(0.299 * p0 + 0.587 * p1 + 0.114 * p2) for p0, p1, p2 in zip(r, g, b)])
+    elif img.mode == "LA":
+        return array('B', raw[0::2])
+    elif img.mode == "L":
+        return array('B', raw)
+    else:
+        raise ValueError("Unsupported image mode: %r" % img.mode)
+
+
+def image_from_planes(mode, image):
+    """
+    Builds a PIL image of the given mode ("L" or "RGB") from a CompactImage,
+    copying byte planes directly instead of going through a pixel list.
+    """
+    size = (image.width, image.height)
+    if any(plane.typecode != 'B' for plane in image.planes):
+        out = Image.new(mode=mode, size=size)
+        out.putdata(image.to_dict()["pixels"])
+        return out
+    if mode == "L":
+        return Image.frombytes(mode, size, image.planes[0].tobytes())
+    raw = bytearray(3 * image.width * image.height)
+    for c, plane in enumerate(image.planes):
+        raw[c::3] = plane
+    return Image.frombytes(mode, size, bytes(raw))
+
+
+def compact_if_bytes(image):
+    """
+    Returns a CompactImage with the pixels of the given dictionary image if
+    they all fit in bytes, and the dictionary itself otherwise.
+    """
+    pixels = image["pixels"]
+    try:
+        if pixels and isinstance(pixels[0], tuple):
+            if any(len(pixel) != 3 for pixel in pixels):
+                return image
+            planes = [array('B', channel) for channel in zip(*pixels)]
+        else:
+            planes = [array('B', pixels)]
+    except (TypeError, OverflowError):
+        return image
+    return CompactImage(image["width"], image["height"], planes)
 
 
 def save_greyscale_image(image, filename, mode="PNG"):
@@ -225,8 +651,105 @@ def save_greyscale_image(image, filename, mode="PNG"):
     filename is given as a file-like object, the file type will be determined
     by the 'mode' parameter.
     """
-    out = Image.new(mode="L", size=(image["width"], image["height"]))
-    out.putdata(image["pixels"])
+    if not isinstance(image, CompactImage):
+        image = compact_if_bytes(image)
+    if isinstance(image, CompactImage):
+        out = image_from_planes("L", image)
+    else:
+        out = Image.new(mode="L", size=(image["width"], image["height"]))
+        out.putdata(image["pixels"])
+    if isinstance(filename, str):
+        out.save(filename)
+    else:
+        out.save(filename, mode)
+    out.close()
+
+
+# STREAMING IMAGES IN BANDS OF ROWS
+
+def load_image_bands(filename, band_height, color=False):
+    """
+    Generator that loads an image (converted to greyscale, or to RGB if color
+    is True) as a sequence of CompactImages of band_height rows each (the last
+    one may be shorter), so that no Python pixel lists are built for the
+    whole image.  PIL still decodes the file itself into its own compact
+    buffer.
+    """
+    with open(filename, "rb") as img_handle:
+        img = Image.open(img_handle)
+        if color:
+            img = img.convert("RGB")
+        w, h = img.size
+        for top in range(0, h, band_height):
+            band = img.crop((0, top, w, min(top + band_height, h)))
+            planes = color_planes(band) if color else [greyscale_plane(band)]
+            yield CompactImage(w, band.height, planes)
+
+
+def filter_bands(bands, filt, radius, boundary_behavior='extend'):
+    """
+    Generator that applies a greyscale filter to an image given as a stream
+    of greyscale bands (CompactImages of the same width, top to bottom),
+    yielding the filtered image as bands of CompactImages.
+
+    filt must only look at pixels within radius rows of the one it computes,
+    and must keep the image size (see tiled_filter).  Only the current band
+    plus radius rows above and below it are held at a time, and the result is
+    identical to filtering the whole image at once.  Only the 'zero' and
+    'extend' boundary behaviors can be streamed.
+    """
+    if boundary_behavior not in ('zero', 'extend'):
+        raise ValueError("Only 'zero' and 'extend' boundaries can be streamed")
+    above = None
+    pending = []
+    width = None
+    for band in bands:
+        width = band.width
+        plane = band.planes[0]
+        rows = [plane[y*width:(y+1)*width] for y in range(band.height)]
+        if above is None:
+            edge = rows[0] if boundary_behavior == 'extend' else make_plane([0]*width)
+            above = [edge]*radius
+        pending.extend(rows)
+        if len(pending) > radius:
+            ready = len(pending) - radius
+            yield filter_rows(filt, width, above + pending, radius, ready)
+            above = (above + pending[:ready])[-radius:] if radius else []
+            pending = pending[ready:]
+    if pending:
+        edge = pending[-1] if boundary_behavior == 'extend' else make_plane([0]*width)
+        yield filter_rows(filt, width, above + pending + [edge]*radius, radius, len(pending))
+
+
+def filter_rows(filt, width, rows, radius, count):
+    """
+    Helper for filter_bands: filters the given rows as one image and returns
+    the count rows after the first radius ones as a CompactImage.
+    """
+    pixels = []
+    for row in rows:
+        pixels.extend(row.tolist())
+    result = filt({'height': len(rows), 'width': width, 'pixels': pixels})
+    return CompactImage(width, count, [make_plane(result['pixels'][radius*width:(radius + count)*width])])
+
+
+def save_image_bands(bands, filename, width, height, mode="PNG"):
+    """
+    Saves an image given as a stream of CompactImage bands (greyscale or
+    color, top to bottom) to disk or to a file-like object, like
+    save_greyscale_image and save_color_image.  The bands are copied into a
+    PIL image one at a time.
+    """
+    out = None
+    top = 0
+    for band in bands:
+        image_mode = "RGB" if band.is_color else "L"
+        if out is None:
+            out = Image.new(mode=image_mode, size=(width, height))
+        out.paste(image_from_planes(image_mode, band), (0, top))
+        top += band.height
+    if out is None:
+        out = Image.new(mode="L", size=(width, height))
     if isinstance(filename, str):
         out.save(filename)
     else:
@@ -235,27 +758,73 @@ def save_greyscale_image(image, filename, mode="PNG"):
 
 #lab 2 stuff!
 
-def color_filter_from_greyscale_filter(filt):
+def color_filter_from_greyscale_filter(filt, executor=None):
     """
     Given a filter that takes a greyscale image as input and produces a
     greyscale image as output, returns a function that takes a color image as
     input and produces the filtered color image.
+
+    If executor (e.g. a concurrent.futures.ThreadPoolExecutor, or a
+    ProcessPoolExecutor when filt can be pickled) is given, the three
+    channels are filtered concurrently on it.
     """
     def color(image):
         """Returns color image with a filter applied to it."""
-        # go to grey scale
-        # apply filt()
-        # take back to color
-        r, g, b = list_of_colors(image)
-        filtered_r = filt(r)
-        filtered_g = filt(g)
-        filtered_b = filt(b)
-        return {'width': image['width'],
-         'height': image['height'],
-         'pixels': [(filtered_r['pixels'][i], filtered_g['pixels'][i], filtered_b['pixels'][i]) for i in range(len(image['pixels']))]
-        }
+        channels = filter_channels([filt], split_channels(image), executor)
+        return merge_channels(image, channels)
+    #lets filter_cascade run several color filters on the same channels
+    color.greyscale_filter = filt
+    color.executor = executor
     return color
 
+def split_channels(image):
+    """
+    Helper function that returns the red, green and blue channels of a color
+    image (a dictionary or a CompactImage) as three greyscale images.
+    """
+    if isinstance(image, CompactImage):
+        channels = [plane.tolist() for plane in image.planes]
+    else:
+        channels = [list(channel) for channel in zip(*image['pixels'])] or [[], [], []]
+    return [{'width': image_width(image), 'height': image_height(image), 'pixels': channel}
+            for channel in channels]
+
+def merge_channels(image, channels):
+    """
+    Helper function that combines three filtered greyscale channels into a
+    color image of the same kind (dictionary or CompactImage) as image.
+    """
+    width, height = channels[0]['width'], channels[0]['height']
+    if isinstance(image, CompactImage):
+        return CompactImage(width, height, [make_plane(channel['pixels']) for channel in channels])
+    return {'width': width,
+            'height': height,
+            'pixels': list(zip(*(channel['pixels'] for channel in channels)))}
+
+def filter_channels(filters, channels, executor=None):
+    """
+    Helper function that applies a sequence of greyscale filters to each of
+    the given channels, one channel per task if an executor is given.
+    """
+    run_filters = partial(apply_filters, filters)
+    if executor is None:
+        return [run_filters(channel) for channel in channels]
+    return list(executor.map(run_filters, channels))
+
+def apply_filters(filters, image):
+    """
+    Applies each of the given filters to the image in turn.
+    """
+    for filt in filters:
+        image = filt(image)
+    return image
+
+def image_width(image):
+    return image.width if isinstance(image, CompactImage) else image['width']
+
+def image_height(image):
+    return image.height if isinstance(image, CompactImage) else image['height']
+
 def list_of_colors(image):
     """
     Helper function that returns three greyscale images g, r, b
@@ -281,6 +850,9 @@ def make_blur_filter(n):
     def blur(image):
         blurred_image = blurred(image, n)
         return blurred_image
+    blur.description = f'blur({n})'
+    if n % 2 == 1:
+        blur.kernel = blur_kernel_creator(n)
     return blur
 
 
@@ -292,21 +864,170 @@ def make_sharpen_filter(n):
     def sharpen(image):
         sharpened_image = sharpened(image, n)
         return sharpened_image
+    sharpen.description = f'sharpen({n})'
+    if n % 2 == 1:
+        sharpen.kernel = list(cached_kernel('sharpen', n))
     return sharpen
 
 
-def filter_cascade(filters):
+def filter_cascade(filters, fuse_linear=False):
     """
     Given a list of filters (implemented as functions on images), returns a new
     single filter such that applying that filter to an image produces the same
     output as applying each of the individual ones in turn.
+
+    See FilterCascade for the optimizations applied and for fuse_linear.
+    """
+    return FilterCascade(filters, fuse_linear)
+
+
+class FilterCascade:
     """
-    def filter_combiner(image):
-        for i in filters:
-            #apply new filters to cumulative image iteratively
-            image = i(image)
+    A filter that applies a list of filters in turn, compiled into a short
+    list of stages when it is created:
+
+    * runs of color filters (from color_filter_from_greyscale_filter, sharing
+      an executor) become one stage that splits the image into channels once
+      and runs the greyscale filters on each channel;
+    * adjacent per-pixel filters (those with a point_function, like inverted)
+      are composed into a single pass over the pixels;
+    * if fuse_linear is True, adjacent filters with a kernel (blur and
+      sharpen filters) are composed into a single correlation.  This skips
+      the rounding and clipping between them (and treats the image edges
+      slightly differently), so the result is only approximately the same;
+      by default these filters are applied one at a time.
+
+    Every other filter is applied as is.  explain() describes the stages.
+    """
+    def __init__(self, filters, fuse_linear=False):
+        self.filters = list(filters)
+        self.fuse_linear = fuse_linear
+        #each stage is (per_channel, executor, steps)
+        self.stages = []
+        for filt in self.filters:
+            greyscale_filter = getattr(filt, 'greyscale_filter', None)
+            per_channel = greyscale_filter is not None
+            executor = filt.executor if per_channel else None
+            if not self.stages or self.stages[-1][:2] != (per_channel, executor):
+                self.stages.append((per_channel, executor, []))
+            self.add_step(self.stages[-1][2], greyscale_filter if per_channel else filt)
+
+    def add_step(self, steps, filt):
+        """
+        Appends filt to a list of steps, fusing it into the last step if
+        possible.
+        """
+        point_function = getattr(filt, 'point_function', None)
+        kernel = getattr(filt, 'kernel', None) if self.fuse_linear else None
+        last = steps[-1] if steps else None
+        if point_function is not None:
+            if last is not None and last.kind == 'point':
+                last.fuse(filt, last.payload + [point_function])
+            else:
+                steps.append(CascadeStep('point', filt, [point_function]))
+        elif kernel is not None:
+            if last is not None and last.kind == 'linear':
+                last.fuse(filt, compose_kernels(last.payload, kernel))
+            else:
+                steps.append(CascadeStep('linear', filt, kernel))
+        else:
+            steps.append(CascadeStep('filter', filt, None))
+
+    def __call__(self, image):
+        for per_channel, executor, steps in self.stages:
+            if per_channel:
+                channels = filter_channels([partial(run_steps, steps)], split_channels(image), executor)
+                image = merge_channels(image, channels)
+            else:
+                image = run_steps(steps, image)
         return image
-    return filter_combiner
+
+    def explain(self):
+        """
+        Returns a human-readable description of the stages of the cascade,
+        showing which filters were fused.
+        """
+        lines = [f'FilterCascade of {len(self.filters)} filters in {len(self.stages)} stages:']
+        for number, (per_channel, executor, steps) in enumerate(self.stages, 1):
+            where = 'per channel' if per_channel else 'whole image'
+            if executor is not None:
+                where += f' on {type(executor).__name__}'
+            lines.append(f'  {number}. {where}:')
+            for step in steps:
+                lines.append(f'       {step}')
+        return '\n'.join(lines)
+
+
+class CascadeStep:
+    """
+    One step of a FilterCascade: a single filter applied as is, or a fused
+    group of per-pixel ('point') or correlation ('linear') filters.
+    """
+    def __init__(self, kind, filt, payload):
+        self.kind = kind
+        self.filters = [filt]
+        self.payload = payload
+
+    def fuse(self, filt, payload):
+        self.filters.append(filt)
+        self.payload = payload
+
+    def __call__(self, image):
+        if len(self.filters) == 1:
+            return self.filters[0](image)
+        if self.kind == 'point':
+            return apply_point_functions(image, self.payload)
+        return apply_kernel(image, self.payload)
+
+    def __str__(self):
+        names = ' -> '.join(filter_name(filt) for filt in self.filters)
+        if len(self.filters) == 1:
+            return names
+        kind = 'per-pixel operations' if self.kind == 'point' else 'kernels'
+        return f'{names}  (fused {len(self.filters)} {kind})'
+
+
+def run_steps(steps, image):
+    for step in steps:
+        image = step(image)
+    return image
+
+def filter_name(filt):
+    return getattr(filt, 'description', None) or getattr(filt, '__name__', repr(filt))
+
+@compact_aware
+def apply_point_functions(image, functions):
+    """
+    Applies several per-pixel functions, in order, in a single pass.
+    """
+    def composed(c):
+        for function in functions:
+            c = function(c)
+        return c
+    return apply_per_pixel(image, composed)
+
+@compact_aware
+def apply_kernel(image, kernel):
+    """
+    Correlates an image with a kernel ('extend' boundary behavior) and rounds
+    and clips the result, like blurred and sharpened do.
+    """
+    return round_and_clip_image(correlate(image, kernel, 'extend'))
+
+def compose_kernels(first, second):
+    """
+    Given two square kernels, returns the kernel equivalent to correlating
+    with first and then with second (ignoring rounding and image edges).
+    """
+    size1, size2 = math.isqrt(len(first)), math.isqrt(len(second))
+    size = size1 + size2 - 1
+    result = [0]*(size*size)
+    for i, a in enumerate(first):
+        y1, x1 = divmod(i, size1)
+        for j, b in enumerate(second):
+            y2, x2 = divmod(j, size2)
+            result[(y1+y2)*size + x1 + x2] += a*b
+    return result
 
     
 
@@ -314,6 +1035,93 @@ def filter_cascade(filters):
 
 
 
+# TILED EXECUTION FOR LARGE IMAGES
+
+def tiled_filter(image, filt, radius, boundary_behavior='extend', workers=None, band_height=None):
+    """
+    Applies a greyscale filter to an image (a dictionary or a CompactImage)
+    by splitting it into horizontal bands that are filtered in parallel on a
+    ProcessPoolExecutor with the given number of workers.
+
+    filt must only look at pixels within radius rows of the one it computes,
+    must keep the image size, and must handle the image's left and right
+    edges with boundary_behavior; it also has to be picklable, so use module
+    level filters or functools.partial, e.g.
+
+        tiled_filter(image, edges, 1)
+        tiled_filter(image, partial(blurred, n=31), 15)
+
+    The source pixels are placed in shared memory, and each band is filtered
+    together with radius extra rows above and below (taken according to
+    boundary_behavior at the top and bottom of the image), so the stitched
+    result is identical to filt(image).
+    """
+    compact = isinstance(image, CompactImage)
+    width, height = image_width(image), image_height(image)
+    plane = image.planes[0] if compact else make_plane(image['pixels'])
+    if band_height is None:
+        band_height = max(-(-height // (4 * (workers or os.cpu_count() or 1))), 1)
+    shared = SharedMemory(create=True, size=max(len(plane) * plane.itemsize, 1))
+    try:
+        shared.buf[:len(plane) * plane.itemsize] = plane.tobytes()
+        with ProcessPoolExecutor(workers) as executor:
+            bands = [executor.submit(filter_band, shared.name, plane.typecode, width, height,
+                                     start, min(start + band_height, height),
+                                     radius, boundary_behavior, filt)
+                     for start in range(0, height, band_height)]
+            if compact:
+                pixels = array(plane.typecode)
+                for band in bands:
+                    band_plane = make_plane(band.result())
+                    if band_plane.typecode != pixels.typecode:
+                        pixels = array('d', pixels)
+                        band_plane = array('d', band_plane)
+                    pixels.extend(band_plane)
+            else:
+                pixels = []
+                for band in bands:
+                    pixels.extend(band.result())
+    finally:
+        shared.close()
+        shared.unlink()
+    if compact:
+        return CompactImage(width, height, [pixels])
+    return {'height': height, 'width': width, 'pixels': pixels}
+
+
+def tiled_correlate(image, kernel, boundary_behavior, workers=None, band_height=None):
+    """
+    Same as correlate(image, kernel, boundary_behavior), computed in parallel
+    bands with tiled_filter.
+    """
+    filt = partial(correlate, kernel=kernel, boundary_behavior=boundary_behavior)
+    return tiled_filter(image, filt, math.isqrt(len(kernel)) // 2, boundary_behavior,
+                        workers, band_height)
+
+
+def filter_band(shared_name, typecode, width, height, start, stop, radius, boundary_behavior, filt):
+    """
+    Worker for tiled_filter: filters rows start through stop-1 of the image
+    in the named shared memory block and returns their pixels as a list.
+    """
+    shared = SharedMemory(name=shared_name)
+    try:
+        #the views are released even if copying fails, or close would raise
+        #BufferError instead of the real error
+        with shared.buf[:width*height*array(typecode).itemsize] as raw, raw.cast(typecode) as source:
+            pixels = []
+            for y in range(start - radius, stop + radius):
+                if 0 <= y < height or boundary_behavior in ('wrap', 'extend'):
+                    y = y % height if boundary_behavior == 'wrap' else min(max(y, 0), height-1)
+                    pixels.extend(source[y*width:(y+1)*width].tolist())
+                else:
+                    pixels.extend([0]*width)
+    finally:
+        shared.close()
+    band = filt({'height': stop - start + 2*radius, 'width': width, 'pixels': pixels})
+    return band['pixels'][radius*width:(radius + stop - start)*width]
+
+
 # SEAM CARVING
 
 # Main Seam Carving Implementation
@@ -327,8 +1135,12 @@ def greyscale_image_from_color_image(image):
     """
     Given a color image, computes and returns a corresponding greyscale image.
 
-    Returns a greyscale image (represented as a dictionary).
+    Returns a greyscale image (represented as a dictionary, or as a
+    CompactImage if given one).
     """
+    if isinstance(image, CompactImage):
+        grey = [round(.299*r + .587*g + .114*b) for r, g, b in zip(*image.planes)]
+        return CompactImage(image.width, image.height, [make_plane(grey)])
     #separate color into three greyscales
     return {'width': image['width'],
          'height': image['height'],
@@ -355,26 +1167,129 @@ def cumulative_energy_map(energy):
     the values in the 'pixels' array may not necessarily be in the range [0,
     255].
     """
-    #create copy of given image with all zeros in it
-    empty_cem = {'height': energy['height'],
-                'width': energy['width'],
-                'pixels': [0 for i in energy['pixels']]}
-    #get the coordinates of the pixel
-    for i in range(len(empty_cem['pixels'])):
-        x, y = get_coordinates(empty_cem, i)
-        #make the top row of the image equal to the top row of the energy map
-        if y == 0:
+    pixels = []
+    for row, _ in cumulative_energy_rows(energy):
+        pixels.extend(row if isinstance(row, list) else row.tolist())
+    return {'height': energy['height'],
+            'width': energy['width'],
+            'pixels': pixels}
+
+
+def cumulative_energy_rows(energy):
+    """
+    Generator that computes the cumulative energy map one row at a time from
+    the previous row, yielding (row, offsets) for each row, top to bottom.
+    offsets[x] is -1, 0 or 1: which pixel above (x-1, x or x+1) the minimum
+    came from, chosen the same way as minimum_energy_seam (the first minimum
+    in that order).  Rows of integer energies are NumPy arrays when NumPy is
+    available (up to the first row that holds some other number), and lists
+    otherwise.
+    """
+    width, height = energy['width'], energy['height']
+    if not width or not height:
+        return
+    pixels = energy['pixels']
+    done = 0
+    if numpy is not None:
+        for values in integer_rows(pixels, width, height):
+            if done:
+                centre[:] = previous
+                best = numpy.minimum(numpy.minimum(left, centre), right)
+                #the first minimum, i.e. x-1 before x before x+1
+                offsets = (centre != best).astype(numpy.int8)
+                offsets[left == best] = -1
+                previous = best + values
+            else:
+                previous = values.astype(numpy.int64)
+                offsets = numpy.zeros(width, numpy.int8)
+                padded = numpy.full(width + 2, numpy.iinfo(numpy.int64).max, numpy.int64)
+                left, centre, right = padded[:-2], padded[1:-1], padded[2:]
+            yield previous, offsets
+            done += 1
+        if done == height:
+            return
+        previous = previous.tolist() if done else None
+    if not done:
+        previous = list(pixels[:width])
+        yield previous, [0]*width
+        done = 1
+    for y in range(done, height):
+        row, offsets = [], []
+        left = [inf] + previous[:-1]
+        right = previous[1:] + [inf]
+        for l, c, r, e in zip(left, previous, right, pixels[y*width:(y+1)*width]):
+            if l <= c and l <= r:
+                row.append(l + e)
+                offsets.append(-1)
+            elif c <= r:
+                row.append(c + e)
+                offsets.append(0)
+            else:
+                row.append(r + e)
+                offsets.append(1)
+        previous = row
+        yield row, offsets
+
+
+def integer_rows(pixels, width, height):
+    """
+    Yields the rows of a flat sequence of pixels as NumPy arrays, stopping
+    at the first row that does not fit in int64 (e.g. one with a float).
+    NumPy arrays and array.array buffers are viewed without copying; other
+    sequences are converted a row at a time.
+    """
+    if isinstance(pixels, array):
+        pixels = numpy.frombuffer(pixels, pixels.typecode)
+    if isinstance(pixels, numpy.ndarray):
+        rows = pixels.reshape(height, width)
+    else:
+        rows = (numpy.asarray(pixels[y*width:(y+1)*width]) for y in range(height))
+    for row in rows:
+        if not numpy.can_cast(row.dtype, numpy.int64):
+            return
+        yield row
+
+
+def cumulative_energy_slice(previous, energies, start, stop):
+    """
+    NumPy version of cumulative_energy_row: given the previous row of a
+    cumulative energy map and the energies of the current row as arrays,
+    returns the cumulative energies for columns start through stop-1.
+    """
+    best = previous[start:stop].copy()
+    #at the edges the pixel above is repeated, which never changes the minimum
+    left = max(start - 1, 0)
+    numpy.minimum(best[left - start + 1:], previous[left:stop - 1], out=best[left - start + 1:])
+    right = min(stop + 1, len(previous))
+    numpy.minimum(best[:right - start - 1], previous[start + 1:right], out=best[:right - start - 1])
+    best += energies[start:stop]
+    return best
+
+
+def energy_seam(energy):
+    """
+    Given an energy image, returns the same seam (a list of indices into the
+    'pixels' list) as minimum_energy_seam(cumulative_energy_map(energy)).
+
+    Only two rows of the cumulative energy map are kept at a time, plus one
+    byte per pixel recording which pixel above each minimum came from, which
+    is all the traceback needs.
+    """
+    width, height = energy['width'], energy['height']
+    backpointers = array('b')
+    for row, offsets in cumulative_energy_rows(energy):
+        backpointers.extend(offsets)
+        bottom = row
+    if isinstance(bottom, list):
+        x = bottom.index(min(bottom))
+    else:
+        x = int(numpy.argmin(bottom))
+    seam = []
+    for y in range(height-1, -1, -1):
+        seam.append(y*width + x)
+        x += backpointers[y*width + x]
+    return seam[::-1]
 
-            empty_cem['pixels'][i] += get_pixel(energy, x, y)
-        #cumulatively add the energies by adding the current energy to the lowest adjacent top energy value
-        else:
-            minimum = float('inf')
-            for j in {x-1, x, x+1}:
-                if get_pixel(empty_cem, j, y-1, 'extend') < minimum:
-                    minimum = get_pixel(empty_cem, j, y-1, 'extend')
-            empty_cem['pixels'][i] += minimum + get_pixel(energy, x, y)
-    return empty_cem
-                
 
 def minimum_energy_seam(cem):
     """
@@ -382,30 +1297,12 @@ def minimum_energy_seam(cem):
     'pixels' list that correspond to pixels contained in the minimum-image
     seam (computed as described in the lab 2 writeup).
     """
-    #establish coordinates +index of bottom min
-    min_energy_seam = []
-    bottom_row = cem['height']-1
-    minimum = float('inf')
-    for i in range(0, cem['width']):
-        if get_pixel(cem, i, bottom_row)< minimum:
-            minimum = get_pixel(cem, i, bottom_row)
-            bottom_index = i
-    min_energy_seam.append(index_returner(cem, bottom_index, bottom_row))
-    #backtrack the energy seam from the second to bottom row to the top row
-    current_index = bottom_index
-    for l in range(bottom_row-1, -1, -1):
-        new_min = float('inf')
-        for k in (current_index-1, current_index, current_index+1):
-            if get_pixel(cem, k, l) < new_min and k >= 0 and k <= (cem['width']-1):
-                new_min = get_pixel(cem,  k, l)
-                current_index = k
-                x = k
-        min_energy_seam.append(index_returner(cem, x, l))
-    return min_energy_seam[::-1]
-    
+    width = cem['width']
+    pixels = cem['pixels']
+    rows = [pixels[y*width:(y+1)*width] for y in range(cem['height'])]
+    return [y*width + x for y, x in enumerate(seam_columns(rows))]
+
 
-    
-    
 def index_returner(image, x, y):
     """
     Given an image and coordinates, return the index of the pixel in the list
@@ -420,19 +1317,110 @@ def image_without_seam(image, seam):
     pixels from the original image except those corresponding to the locations
     in the given list.
     """
-    new_image = {'width': image['width'],
-         'height': image['height'],
-         'pixels': image['pixels'][:]}
-    new_image['width'] -= 1
-    for i in range(len(seam)):
-        new_image['pixels'].pop(seam[i]-i)
-    return new_image
+    return remove_seams(image, [seam], with_index_map=False)[0]
+
+def remove_seams(image, seams, in_place=False, with_index_map=True):
+    """
+    Given an image (a dictionary or a CompactImage) and a list of seams (each
+    a list of indices into its pixels, one per row), removes all of their
+    pixels in a single pass and returns (new_image, index_map), where
+    index_map[i] is the index in the original image of pixel i of the new
+    one.  index_map can be passed to remap to keep other per-pixel data (such
+    as an energy map) aligned with the new image.
+
+    If in_place is True, the pixel list (or the planes of a CompactImage) is
+    compacted in place and image itself is returned, updated.  If
+    with_index_map is False, None is returned instead of the index map.
+
+    Raises a ValueError if a seam does not have exactly one pixel in each row
+    or if two seams share a pixel, since every row must lose len(seams)
+    pixels.
+    """
+    old_width, height = image_width(image), image_height(image)
+    for seam in seams:
+        if sorted(index // old_width for index in seam) != list(range(height)):
+            raise ValueError("Each seam needs exactly one pixel in each row")
+    doomed = sorted({index for seam in seams for index in seam})
+    if len(doomed) != len(seams) * height:
+        raise ValueError("Seams must not overlap")
+    width = old_width - len(seams)
+    compact = isinstance(image, CompactImage)
+    sources = image.planes if compact else [image['pixels']]
+    index_map = None
+    if with_index_map:
+        index_map = array('q')
+        for start, stop in kept_ranges(doomed, len(sources[0])):
+            index_map.extend(range(start, stop))
+    results = [compact_pixels(source, doomed, in_place) for source in sources]
+    if in_place:
+        if compact:
+            image.width = width
+        else:
+            image['width'] = width
+        return image, index_map
+    if compact:
+        return CompactImage(width, height, results), index_map
+    return {'width': width, 'height': height, 'pixels': results[0]}, index_map
 
-def seam_carving(image, ncols):
+def compact_pixels(pixels, doomed, in_place=False):
+    """
+    Returns the pixels (a list or an array) without the given sorted indices,
+    copying the runs of kept pixels as slices.  If in_place is True, the runs
+    are moved down within pixels itself, which is then truncated.
+    """
+    if not in_place:
+        result = pixels[:0]
+        for start, stop in kept_ranges(doomed, len(pixels)):
+            result += pixels[start:stop]
+        return result
+    end = 0
+    for start, stop in kept_ranges(doomed, len(pixels)):
+        pixels[end:end + stop - start] = pixels[start:stop]
+        end += stop - start
+    del pixels[end:]
+    return pixels
+
+def kept_ranges(doomed, length):
+    """
+    Yields the (start, stop) ranges of indices below length that are not in
+    the sorted list doomed.
+    """
+    start = 0
+    for index in doomed:
+        if index > start:
+            yield start, index
+        start = index + 1
+    if start < length:
+        yield start, length
+
+def remap(values, index_map):
+    """
+    Given per-pixel values for an image and the index_map returned by
+    remove_seams, returns the values for the pixels that were kept.
+    """
+    return [values[i] for i in index_map]
+
+@compact_aware
+def seam_carving(image, ncols, incremental=True, seams_per_pass=1, energy='backward'):
     """
     Starting from the given image, use the seam carving technique to remove
     ncols (an integer) columns from the image. Returns a new image.
+
+    By default the energy and cumulative energy maps are updated in place
+    around each removed seam (see incremental_seam_carving); pass
+    incremental=False to recompute everything from scratch for every seam.
+    Both modes produce identical images.
+
+    seams_per_pass > 1 trades quality for speed: that many disjoint seams
+    are taken from each cumulative energy map and removed together (see
+    batch_seam_carving), so the maps are only computed about
+    ncols/seams_per_pass times.  energy='forward' uses forward energy
+    (the cost of the new edges a seam creates) instead of edges().
     """
+    if seams_per_pass != 1 or energy != 'backward':
+        return batch_seam_carving(image, ncols, seams_per_pass, energy)
+    if incremental:
+        return incremental_seam_carving(image, ncols)
     count = 0
     new_image = {'width': image['width'],
          'height': image['height'],
@@ -440,8 +1428,7 @@ def seam_carving(image, ncols):
     while count < ncols: 
         grey = greyscale_image_from_color_image(new_image)
         energy = compute_energy(grey)
-        cem = cumulative_energy_map(energy)
-        seam = minimum_energy_seam(cem)
+        seam = energy_seam(energy)
         seamless_image =  image_without_seam(new_image, seam)
         new_image = seamless_image
         count += 1
@@ -449,6 +1436,488 @@ def seam_carving(image, ncols):
 
 
 
+def incremental_seam_carving(image, ncols):
+    """
+    Removes ncols seams like seam_carving, but keeps the greyscale image, the
+    energy map and the cumulative energy map (as lists of rows, or as NumPy
+    arrays in numpy_seam_carving when NumPy is installed) between seams.
+    After a seam is removed, energy only changes within one column of where
+    the seam passed through the row and its neighbors, and the cumulative
+    energy only changes below those pixels, so only those entries are
+    recomputed; everything else just shifts left with the seam removal.
+    """
+    width, height = image['width'], image['height']
+    if numpy is not None and width and height:
+        return numpy_seam_carving(image, ncols)
+    pixels = image['pixels']
+    colors = [pixels[y*width:(y+1)*width] for y in range(height)]
+    grey = greyscale_rows(colors)
+    energy = sobel_rows(grey)
+    cem = [energy[0][:]]
+    for y in range(1, height):
+        cem.append(cumulative_energy_row(cem[y-1], energy[y], 0, width))
+    for _ in range(ncols):
+        seam = seam_columns(cem)
+        for y, x in enumerate(seam):
+            del colors[y][x], grey[y][x], energy[y][x], cem[y][x]
+        width -= 1
+        changed = None
+        for y in range(height):
+            #energy depends on a 3x3 neighborhood, so only pixels next to the
+            #seam in this row or the rows above and below can change
+            nearby = seam[max(y-1, 0):y+2]
+            start, stop = max(min(nearby) - 1, 0), min(max(nearby) + 1, width)
+            energy[y][start:stop] = sobel_energies(grey, y, start, stop)
+            #cumulative energy also changes below any entry that changed
+            if changed is not None:
+                start = min(start, max(changed[0] - 1, 0))
+                stop = max(stop, min(changed[1] + 2, width))
+            if y == 0:
+                new_values = energy[0][start:stop]
+            else:
+                new_values = cumulative_energy_row(cem[y-1], energy[y], start, stop)
+            differing = [x for x, value in enumerate(new_values, start) if cem[y][x] != value]
+            cem[y][start:stop] = new_values
+            changed = (differing[0], differing[-1]) if differing else None
+    return {'width': width,
+         'height': height,
+         'pixels': [pixel for row in colors for pixel in row]}
+
+
+def numpy_seam_carving(image, ncols):
+    """
+    incremental_seam_carving with the greyscale image and the energy maps as
+    2D NumPy arrays.  Removing a seam shifts the rest of each row left in
+    place, the energies next to the seam are recomputed for all rows at once,
+    and the cumulative energies below the changes a row at a time with
+    cumulative_energy_slice.  columns tracks which column of the original
+    image each pixel came from, so the colors are only gathered at the end.
+    """
+    width, height = image['width'], image['height']
+    pixels = image['pixels']
+    #one array for all the maps, so each row shifts in one step
+    planes = numpy.empty((height, width, 4), numpy.int64)
+    grey, energy, cem, columns = (planes[..., i] for i in range(4))
+    grey[:] = greyscale_array(color_array(pixels, width, height))
+    energy[:] = sobel_array(grey)
+    cem[:] = [row for row, _ in cumulative_energy_rows(
+        {'width': width, 'height': height, 'pixels': energy.ravel()})]
+    columns[:] = numpy.arange(width)
+    rows = numpy.arange(height)
+    above, below = numpy.maximum(rows - 1, 0), numpy.minimum(rows + 1, height - 1)
+    middle = rows[:, None]
+    for _ in range(ncols):
+        seam = numpy.array(seam_columns_array(cem[:, :width]))
+        for y, x in enumerate(seam.tolist()):
+            planes[y, x:width-1] = planes[y, x+1:width]
+        width -= 1
+        if not width:
+            continue
+        #the same windows as incremental_seam_carving, at most 4 columns wide
+        nearby = numpy.stack([seam[above], seam, seam[below]])
+        start = numpy.maximum(nearby.min(axis=0) - 1, 0)
+        stop = numpy.minimum(nearby.max(axis=0) + 1, width)
+        xs = numpy.minimum(start[:, None] + numpy.arange(4), stop[:, None] - 1)
+        left, right = numpy.maximum(xs - 1, 0), numpy.minimum(xs + 1, width - 1)
+        up, down = above[:, None], below[:, None]
+        ox = (grey[up, right] - grey[up, left] + 2*(grey[middle, right] - grey[middle, left])
+              + grey[down, right] - grey[down, left])
+        oy = (grey[down, left] + 2*grey[down, xs] + grey[down, right]
+              - grey[up, left] - 2*grey[up, xs] - grey[up, right])
+        energy[middle, xs] = numpy.minimum(numpy.rint(numpy.sqrt(ox*ox + oy*oy)), 255)
+        changed = None
+        for y in range(height):
+            a, b = int(start[y]), int(stop[y])
+            if changed is not None:
+                a = min(a, max(changed[0] - 1, 0))
+                b = max(b, min(changed[1] + 2, width))
+            if y == 0:
+                new_values = energy[0, a:b]
+            else:
+                new_values = cumulative_energy_slice(cem[y-1, :width], energy[y], a, b)
+            differing = numpy.flatnonzero(cem[y, a:b] != new_values)
+            cem[y, a:b] = new_values
+            changed = (a + int(differing[0]), a + int(differing[-1])) if len(differing) else None
+    indices = (columns[:, :width] + middle * image['width']).ravel().tolist()
+    return {'width': width,
+         'height': height,
+         'pixels': [pixels[i] for i in indices]}
+
+
+def batch_seam_carving(image, ncols, seams_per_pass=1, energy='backward'):
+    """
+    Removes ncols seams from a color image, taking up to seams_per_pass
+    disjoint, non-crossing seams from each cumulative energy map (see
+    batch_seams) and removing them all in one pass over the rows.  energy is
+    'backward' (the edges() energy used by seam_carving) or 'forward'.
+    """
+    if energy not in ('backward', 'forward'):
+        raise ValueError(f"Unknown energy: {energy!r}")
+    width, height = image['width'], image['height']
+    pixels = image['pixels']
+    colors = [pixels[y*width:(y+1)*width] for y in range(height)]
+    removed = 0
+    while removed < ncols:
+        if energy == 'forward':
+            cem, parent_cost = forward_energy_map(greyscale_rows(colors))
+        else:
+            cem, parent_cost = backward_energy_map(colors)
+        seams = batch_seams(cem, min(seams_per_pass, ncols - removed), parent_cost)
+        for y, row in enumerate(colors):
+            doomed = {seam[y] for seam in seams}
+            colors[y] = [pixel for x, pixel in enumerate(row) if x not in doomed]
+        width -= len(seams)
+        removed += len(seams)
+    return {'width': width,
+         'height': height,
+         'pixels': [pixel for row in colors for pixel in row]}
+
+
+def forward_energy_map(grey):
+    """
+    Given a greyscale image as a list of rows, returns its cumulative forward
+    energy map (as a list of rows) and a function parent_cost(y, x, p) giving
+    the cost of reaching column x of row y from column p of row y-1.
+
+    Forward energy charges a seam for the differences between the pixels
+    that become neighbors when it is removed, rather than for the gradient
+    of the removed pixels themselves.
+    """
+    height, width = len(grey), len(grey[0])
+    last = width - 1
+    def costs(y, x):
+        row = grey[y]
+        left, right = row[max(x-1, 0)], row[min(x+1, last)]
+        up = abs(right - left)
+        if y == 0:
+            return up, up, up
+        above = grey[y-1][x]
+        return up + abs(above - left), up, up + abs(above - right)
+    def parent_cost(y, x, p):
+        return cem[y-1][p] + costs(y, x)[p - x + 1]
+    cem = [[costs(0, x)[1] for x in range(width)]]
+    for y in range(1, height):
+        cem.append([min(parent_cost(y, x, p) for p in (x-1, x, x+1) if 0 <= p <= last)
+                    for x in range(width)])
+    return cem, parent_cost
+
+
+def batch_seams(cem, count, parent_cost):
+    """
+    Returns up to count disjoint, non-crossing seams (each a list of columns,
+    top to bottom) from one cumulative energy map.  Seams are traced upward
+    from the bottom row in order of increasing cumulative energy, each step
+    going to the cheapest parent (by parent_cost) that no earlier seam uses
+    or crosses; candidates that get boxed in are skipped.  The first seam is
+    always the minimum energy seam.
+    """
+    height, width = len(cem), len(cem[0])
+    #for each row, the columns used by accepted seams -> their column in the row above
+    taken = [{} for _ in range(height)]
+    seams = []
+    for start in sorted(range(width), key=lambda x: cem[-1][x]):
+        if len(seams) == count:
+            break
+        if start in taken[-1]:
+            continue
+        path = [start]
+        x = start
+        for y in range(height-1, 0, -1):
+            #a seam ending left of x must stay left of our parent, and vice versa
+            low = taken[y][x-1] + 1 if x-1 in taken[y] else 0
+            high = taken[y][x+1] - 1 if x+1 in taken[y] else width-1
+            options = [p for p in (x-1, x, x+1) if low <= p <= high and p not in taken[y-1]]
+            if not options:
+                break
+            x = min(options, key=lambda p: parent_cost(y, x, p))
+            path.append(x)
+        else:
+            path.reverse()
+            for y in range(height):
+                taken[y][path[y]] = path[y-1] if y else None
+            seams.append(path)
+    return seams
+
+
+def plan_seams(energy, count):
+    """
+    Plans count disjoint seams of an energy image in a single pass, for
+    seam insertion: the seams end at the count lowest entries of the bottom
+    row of the cumulative energy map and follow its offsets upward, all at
+    once.  Where seams would meet, they are pushed apart, which keeps each
+    seam connected and the seams in order.  Returns the columns of the seams
+    in each row (left to right) as a list of rows, top to bottom.
+    """
+    width, height = energy['width'], energy['height']
+    offsets = []
+    for bottom, row_offsets in cumulative_energy_rows(energy):
+        offsets.append(row_offsets)
+    last = width - 1
+    if not isinstance(bottom, list):
+        order = numpy.arange(count)
+        columns = numpy.sort(numpy.argsort(bottom, kind='stable')[:count])
+        rows = [columns]
+        for y in range(height-1, 0, -1):
+            parents = columns + offsets[y][columns]
+            #push seams right of any seam they would meet, then left of the edge
+            columns = numpy.maximum.accumulate(parents - order) + order
+            if columns[-1] > last:
+                columns[-1] = last
+                columns = numpy.minimum.accumulate((columns - order)[::-1])[::-1] + order
+            rows.append(columns)
+        return numpy.array(rows[::-1]).tolist()
+    columns = sorted(sorted(range(width), key=bottom.__getitem__)[:count])
+    rows = [columns]
+    for y in range(height-1, 0, -1):
+        parents = [x + offsets[y][x] for x in columns]
+        for i in range(1, count):
+            parents[i] = max(parents[i], parents[i-1] + 1)
+        if parents[-1] > last:
+            parents[-1] = last
+            for i in range(count-2, -1, -1):
+                parents[i] = min(parents[i], parents[i+1] - 1)
+        columns = parents
+        rows.append(columns)
+    return rows[::-1]
+
+
+def greyscale_rows(colors):
+    """
+    Given a color image as a list of rows, returns the rows of
+    greyscale_image_from_color_image of that image.
+    """
+    return [[round(.299*r + .587*g + .114*b) for r, g, b in row] for row in colors]
+
+
+def color_array(pixels, width, height):
+    """
+    Returns a list of color pixels as a height by width by 3 NumPy array.
+    """
+    try:
+        #much faster than fromiter, for the usual 0-255 integer pixels
+        values = numpy.frombuffer(bytes(chain.from_iterable(pixels)), numpy.uint8)
+    except (TypeError, ValueError):
+        values = numpy.fromiter(chain.from_iterable(pixels), numpy.float64, 3*width*height)
+    return values.reshape(height, width, 3)
+
+
+def greyscale_array(colors):
+    """
+    NumPy version of greyscale_rows for a color_array: returns the greyscale
+    image as a 2D int64 array.
+    """
+    #same operations in the same order as greyscale_rows, so identical results
+    grey = .299*colors[..., 0] + .587*colors[..., 1] + .114*colors[..., 2]
+    return numpy.rint(grey).astype(numpy.int64)
+
+
+def color_energy(image):
+    """
+    Returns the (edges()) energy image of a color image, using NumPy when it
+    is available; its pixels may then be an array.
+    """
+    width, height = image['width'], image['height']
+    pixels = image['pixels']
+    if numpy is not None and width and height:
+        energies = sobel_array(greyscale_array(color_array(pixels, width, height))).ravel()
+    else:
+        colors = [pixels[y*width:(y+1)*width] for y in range(height)]
+        energies = [e for row in sobel_rows(greyscale_rows(colors)) for e in row]
+    return {'width': width, 'height': height, 'pixels': energies}
+
+
+def backward_energy_map(colors):
+    """
+    Given a color image as a list of rows, returns its cumulative (edges())
+    energy map as a list of rows, and the matching parent_cost for
+    batch_seams.
+    """
+    energies = sobel_rows(greyscale_rows(colors))
+    energy = {'width': len(energies[0]), 'height': len(energies),
+              'pixels': [e for row in energies for e in row]}
+    #batch_seams looks up single entries, which is much faster in lists
+    cem = [row if isinstance(row, list) else row.tolist()
+           for row, _ in cumulative_energy_rows(energy)]
+    return cem, lambda y, x, p: cem[y-1][p]
+
+
+@compact_aware
+def seam_insertion(image, ncols):
+    """
+    Widens a color image by ncols columns using seam insertion: ncols
+    low-energy seams are found (as if they were being removed, so they do
+    not overlap), and next to each of their pixels a new pixel is inserted
+    with the average color of that pixel's left and right neighbors.
+
+    The seams are planned together with plan_seams; at most half the current
+    width is inserted at a time, so very large ncols are done in several
+    rounds.
+    """
+    while ncols > 0:
+        step = min(ncols, max(image['width'] // 2, 1))
+        image = insert_seams(image, step)
+        ncols -= step
+    return image
+
+
+def insert_seams(image, ncols):
+    """
+    Helper for seam_insertion: duplicates ncols seams of the image at once.
+    """
+    width, height = image['width'], image['height']
+    pixels = image['pixels']
+    if not (width and height):
+        return {'width': width, 'height': height, 'pixels': pixels[:]}
+    if numpy is not None:
+        colors = color_array(pixels, width, height)
+        energies = sobel_array(greyscale_array(colors)).ravel()
+        seams = numpy.array(plan_seams({'width': width, 'height': height, 'pixels': energies}, ncols))
+        rows = numpy.arange(height)[:, None]
+        duplicated = (seams + rows*width).ravel()
+        left = colors[rows, numpy.maximum(seams - 1, 0)].astype(numpy.float64)
+        right = colors[rows, numpy.minimum(seams + 1, width - 1)]
+        averages = numpy.rint((left + right) / 2).astype(numpy.int64).reshape(-1, 3)
+        #indices into pixels followed by the new pixels, in the output order
+        counts = numpy.ones(width*height, numpy.int64)
+        counts[duplicated] = 2
+        sources = numpy.repeat(numpy.arange(width*height), counts)
+        #each duplicate moves everything after it one place further along
+        inserted = duplicated + numpy.arange(1, len(duplicated) + 1)
+        sources[inserted] = width*height + numpy.arange(len(duplicated))
+        everything = pixels + list(zip(*averages.T.tolist()))
+        new_pixels = list(map(everything.__getitem__, sources.tolist()))
+    else:
+        seams = plan_seams(color_energy(image), ncols)
+        new_pixels = []
+        for y in range(height):
+            row = pixels[y*width:(y+1)*width]
+            duplicated = set(seams[y])
+            for x, pixel in enumerate(row):
+                new_pixels.append(pixel)
+                if x in duplicated:
+                    left, right = row[max(x-1, 0)], row[min(x+1, width-1)]
+                    new_pixels.append(tuple(round((a + b) / 2) for a, b in zip(left, right)))
+    return {'width': width + ncols,
+            'height': height,
+            'pixels': new_pixels}
+
+
+@compact_aware
+def transposed(image):
+    """
+    Returns the image flipped along its main diagonal, so that its rows
+    become columns.  Used to carve or insert rows with the column routines.
+    """
+    width, height = image['width'], image['height']
+    pixels = image['pixels']
+    new_pixels = []
+    for x in range(width):
+        new_pixels.extend(pixels[x::width])
+    return {'width': height,
+            'height': width,
+            'pixels': new_pixels}
+
+
+@compact_aware
+def planned_seam_carving(image, ncols):
+    """
+    Removes ncols seams from a color image, all planned together with
+    plan_seams from a single energy map.  This is much faster than
+    seam_carving for many seams, but the seams do not adapt to each other's
+    removal.
+    """
+    width = image['width']
+    rows = plan_seams(color_energy(image), ncols)
+    seams = [[y*width + x for y, x in enumerate(seam)] for seam in zip(*rows)]
+    return remove_seams(image, seams, with_index_map=False)[0]
+
+
+@compact_aware
+def retarget(image, new_width, new_height, seams_per_pass=None):
+    """
+    Resizes a color image to new_width by new_height with content-aware seam
+    carving (to shrink) and seam insertion (to grow): columns are adjusted
+    first, then rows (by working on the transposed image).  By default the
+    seams removed in each direction are planned together
+    (planned_seam_carving); otherwise seams_per_pass is passed on to
+    seam_carving.
+    """
+    for _ in range(2):
+        ncols = image['width'] - new_width
+        if ncols > 0 and seams_per_pass is None:
+            image = planned_seam_carving(image, ncols)
+        elif ncols > 0:
+            image = seam_carving(image, ncols, seams_per_pass=seams_per_pass)
+        elif ncols < 0:
+            image = seam_insertion(image, -ncols)
+        image = transposed(image)
+        new_width, new_height = new_height, new_width
+    return image
+
+
+def sobel_energies(grey, y, start, stop):
+    """
+    Given a greyscale image as a list of rows, returns the edges() values of
+    row y for columns start through stop-1, using the 'extend' boundary
+    behavior.
+    """
+    width, height = len(grey[y]), len(grey)
+    above, row, below = grey[max(y-1, 0)], grey[y], grey[min(y+1, height-1)]
+    result = []
+    for x in range(start, stop):
+        left, right = max(x-1, 0), min(x+1, width-1)
+        ox = above[right] - above[left] + 2*(row[right] - row[left]) + below[right] - below[left]
+        oy = below[left] + 2*below[x] + below[right] - above[left] - 2*above[x] - above[right]
+        result.append(min(round((ox**2 + oy**2)**(1/2)), 255))
+    return result
+
+
+def cumulative_energy_row(previous, energies, start, stop):
+    """
+    Given the previous row of a cumulative energy map and the energies of the
+    current row, returns the cumulative energies for columns start through
+    stop-1 (using the 'extend' boundary behavior, like cumulative_energy_map).
+    """
+    last = len(previous) - 1
+    return [min(previous[max(x-1, 0)], previous[x], previous[min(x+1, last)]) + energies[x]
+            for x in range(start, stop)]
+
+
+def seam_columns(cem):
+    """
+    Given a cumulative energy map as a list of rows, returns the column of the
+    minimum energy seam in each row (top to bottom), breaking ties the same
+    way as minimum_energy_seam.
+    """
+    bottom = cem[-1]
+    current = bottom.index(min(bottom))
+    last = len(bottom) - 1
+    seam = [current]
+    for row in reversed(cem[:-1]):
+        minimum = float('inf')
+        for k in (current-1, current, current+1):
+            if 0 <= k <= last and row[k] < minimum:
+                minimum = row[k]
+                x = k
+        current = x
+        seam.append(current)
+    return seam[::-1]
+
+
+def seam_columns_array(cem):
+    """
+    seam_columns for a cumulative energy map that is a 2D NumPy array.
+    """
+    current = int(cem[-1].argmin())
+    seam = [current]
+    for y in range(len(cem) - 2, -1, -1):
+        low = max(current - 1, 0)
+        current = low + int(cem[y, low:current + 2].argmin())
+        seam.append(current)
+    return seam[::-1]
+
+
+@compact_aware
 def custom_feature(image):
     """ 
     Takes a color image and swaps the rgb colors such that r is now g, g is now b,
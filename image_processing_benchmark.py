@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for image_processing.py.
+
+Run as, for example:
+    python image_processing_benchmark.py run --sizes 64 256 1024 --output bench.json
+    python image_processing_benchmark.py run --compare-with old_image_processing.py
+    python image_processing_benchmark.py run --images test_images/cat.png --ops edges
+    python image_processing_benchmark.py tiled --size 2048 --workers 1 2 4 8
+
+Every run prints (or writes) a JSON document with the time, pixels per
+second and peak traced memory of each operation, so results can be tracked
+over time.  With --compare-with, every output is also checked for bit-exact
+equality against another implementation of the module (e.g. an older
+version checked out of git).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+import importlib.util
+from functools import partial
+
+import image_processing
+
+
+def synthetic_greyscale(width, height, seed=0):
+    """
+    Returns a reproducible greyscale image with smooth gradients plus noise.
+    """
+    rng = random.Random(seed)
+    return {
+        "height": height,
+        "width": width,
+        "pixels": [
+            min(255, (x * 255 // max(width - 1, 1) + y * 255 // max(height - 1, 1)) // 2
+                + rng.randint(0, 32))
+            for y in range(height)
+            for x in range(width)
+        ],
+    }
+
+
+def synthetic_color(width, height, seed=0):
+    """
+    Returns a reproducible color image built from three synthetic channels.
+    """
+    channels = [synthetic_greyscale(width, height, seed + c)["pixels"] for c in range(3)]
+    channels[1] = channels[1][::-1]
+    return {"height": height, "width": width, "pixels": list(zip(*channels))}
+
+
+def cascade(module, image):
+    color = module.color_filter_from_greyscale_filter
+    filt = module.filter_cascade([
+        color(module.edges), color(module.inverted), color(module.make_blur_filter(5)),
+    ])
+    return filt(image)
+
+
+# name -> (needs a color image, function of (module, image))
+OPERATIONS = {
+    "inverted": (False, lambda m, im: m.inverted(im)),
+    "blurred(3)": (False, lambda m, im: m.blurred(im, 3)),
+    "blurred(9)": (False, lambda m, im: m.blurred(im, 9)),
+    "blurred(31)": (False, lambda m, im: m.blurred(im, 31)),
+    "sharpened(5)": (False, lambda m, im: m.sharpened(im, 5)),
+    "edges": (False, lambda m, im: m.edges(im)),
+    "filter_cascade": (True, cascade),
+    "seam_carving": (True, lambda m, im: m.seam_carving(im, max(image_width(im) // 16, 1))),
+}
+
+
+def image_width(image):
+    return image.width if hasattr(image, "width") else image["width"]
+
+
+def load_module(path):
+    """
+    Imports another implementation of image_processing from a file path.
+    """
+    name = "image_processing_" + os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def as_dict(image):
+    return image.to_dict() if isinstance(image, image_processing.CompactImage) else image
+
+
+def measure(func, repeat, memory):
+    """
+    Runs func repeat times and returns (output, best seconds, peak bytes),
+    where the peak is measured in one extra traced run if memory is True.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func()
+        best = min(best, time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return output, best, peak
+
+
+def workloads(sizes, images):
+    """
+    Yields (name, greyscale image, color image) for each synthetic size and
+    each real image file.
+    """
+    for size in sizes:
+        yield f"synthetic {size}x{size}", synthetic_greyscale(size, size), synthetic_color(size, size)
+    for filename in images:
+        yield (filename, image_processing.load_greyscale_image(filename),
+               image_processing.load_color_image(filename))
+
+
+def run(sizes, images, ops, variants, repeat=1, memory=True, compare_with=None):
+    """
+    Benchmarks the given operations on every workload and returns a list of
+    result dictionaries.  variants is a subset of ("dict", "compact"): the
+    representation the images are passed in.
+    """
+    other = load_module(compare_with) if compare_with else None
+    results = []
+    for workload, grey, color in workloads(sizes, images):
+        for op in ops:
+            needs_color, func = OPERATIONS[op]
+            source = color if needs_color else grey
+            expected = None
+            if other is not None:
+                expected, other_seconds, _ = measure(partial(func, other, source), 1, False)
+            for variant in variants:
+                image = source
+                if variant == "compact":
+                    image = image_processing.CompactImage.from_dict(source)
+                output, seconds, peak = measure(partial(func, image_processing, image), repeat, memory)
+                pixels = source["width"] * source["height"]
+                result = {
+                    "operation": op,
+                    "workload": workload,
+                    "width": source["width"],
+                    "height": source["height"],
+                    "variant": variant,
+                    "seconds": seconds,
+                    "pixels_per_second": pixels / seconds if seconds else None,
+                    "peak_bytes": peak,
+                }
+                if other is not None:
+                    result["identical"] = as_dict(output) == expected
+                    result["compared_seconds"] = other_seconds
+                results.append(result)
+                print(f"{op:>15} {workload:>24} {variant:>8} {seconds:10.4f}s", file=sys.stderr)
+    return results
+
+
+def tiled_scaling(size, worker_counts, repeat=1):
+    """
+    Times tiled_filter for edges, blurred and sharpened on a size-by-size
+    greyscale image with each of the given worker counts, checking that the
+    output matches the single-process filter.  Returns a list of result
+    dictionaries.
+    """
+    image = synthetic_greyscale(size, size)
+    cases = [
+        ("edges", image_processing.edges, 1),
+        ("blurred(31)", partial(image_processing.blurred, n=31), 15),
+        ("sharpened(5)", partial(image_processing.sharpened, n=5), 2),
+    ]
+    results = []
+    for name, filt, radius in cases:
+        start = time.perf_counter()
+        expected = filt(image)
+        serial = time.perf_counter() - start
+        for workers in worker_counts:
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                output = image_processing.tiled_filter(image, filt, radius, workers=workers)
+                best = min(best, time.perf_counter() - start)
+            results.append({
+                "filter": name,
+                "size": size,
+                "workers": workers,
+                "seconds": best,
+                "serial_seconds": serial,
+                "speedup": serial / best,
+                "identical": output == expected,
+            })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    #shared by every command, so --output goes after the command name
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--output", help="write the JSON results to this file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("run", parents=[common], help="time the filters and seam carving")
+    bench.add_argument("--sizes", type=int, nargs="*", default=[64, 256, 1024])
+    bench.add_argument("--images", nargs="*", default=[], help="real image files to include")
+    bench.add_argument("--ops", nargs="+", default=list(OPERATIONS), choices=list(OPERATIONS))
+    bench.add_argument("--variants", nargs="+", default=["dict", "compact"],
+                       choices=["dict", "compact"])
+    bench.add_argument("--repeat", type=int, default=1)
+    bench.add_argument("--no-memory", action="store_true", help="skip the traced peak-memory run")
+    bench.add_argument("--compare-with", help="path of another image_processing.py to check against")
+    tiled = commands.add_parser("tiled", parents=[common], help="scaling of tiled_filter with worker count")
+    tiled.add_argument("--size", type=int, default=1024)
+    tiled.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    tiled.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        results = run(args.sizes, args.images, args.ops, args.variants, args.repeat,
+                      not args.no_memory, args.compare_with)
+    else:
+        results = tiled_scaling(args.size, args.workers, args.repeat)
+    document = {
+        "command": args.command,
+        "python": platform.python_version(),
+        "numpy": image_processing.numpy is not None,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2)
+    else:
+        json.dump(document, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
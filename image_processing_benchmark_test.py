@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import json
+
+import image_processing_benchmark as benchmark
+
+
+def run_benchmark(tmp_path, *extra):
+    output = tmp_path / "bench.json"
+    benchmark.main(["run", "--sizes", "8", "--no-memory", "--output", str(output), *extra])
+    with open(output) as f:
+        return json.load(f)
+
+
+def test_run_writes_one_result_per_operation_and_variant(tmp_path):
+    document = run_benchmark(tmp_path)
+    assert document["command"] == "run"
+    assert set(document) == {"command", "python", "numpy", "timestamp", "results"}
+    results = document["results"]
+    assert [(r["operation"], r["variant"]) for r in results] == [
+        (op, variant) for op in benchmark.OPERATIONS for variant in ("dict", "compact")
+    ]
+    for result in results:
+        assert result["workload"] == "synthetic 8x8"
+        assert (result["width"], result["height"]) == (8, 8)
+        assert result["seconds"] >= 0
+        assert result["peak_bytes"] is None
+        assert "identical" not in result
+
+
+def test_compare_with_checks_outputs(tmp_path):
+    document = run_benchmark(tmp_path, "--compare-with", benchmark.image_processing.__file__)
+    assert all(r["identical"] for r in document["results"])
+    assert all(r["compared_seconds"] >= 0 for r in document["results"])
+
+    #an implementation with a different inverted should only differ there
+    other = tmp_path / "other.py"
+    other.write_text(
+        "from image_processing import *\n"
+        "def inverted(image):\n"
+        "    return {**image, 'pixels': [0] * len(image['pixels'])}\n"
+    )
+    document = run_benchmark(tmp_path, "--compare-with", str(other), "--ops", "inverted", "edges",
+                             "--variants", "dict")
+    assert {r["operation"]: r["identical"] for r in document["results"]} == {
+        "inverted": False,
+        "edges": True,
+    }
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Opt-in profiling of the filters and seam carving stages in image_processing.
+
+    import image_processing_profiler as profiler
+
+    with profiler.profiling() as stats:
+        image_processing.seam_carving(image, 10)
+    print(profiler.report_text(stats))
+
+or, to profile a whole script:
+    python image_processing_profiler.py --json report.json my_script.py args...
+
+While profiling is enabled, the module-level functions named in STAGES are
+replaced by wrappers that count calls, wall time, pixels processed (the size
+of the image they are given) and, with memory=True, bytes allocated (peak
+traced memory above what was in use when the call started).  Because the
+module's own functions look each other up by name, calls made inside
+image_processing are counted too.  Times are inclusive: a call to blurred
+also counts towards the correlate or box_sums calls it makes.
+
+Disabling profiling puts the original functions back, so there is no
+overhead at all when it is not in use.
+"""
+import sys
+import json
+import time
+import runpy
+import inspect
+import argparse
+import tracemalloc
+from functools import wraps
+from contextlib import contextmanager
+
+import image_processing
+
+
+STAGES = [
+    #per-pixel helpers
+    "get_pixel", "set_pixel", "apply_per_pixel", "round_and_clip_image",
+    #filters
+    "inverted", "correlate", "correlate_by_pixel", "box_sums", "blurred", "sharpened",
+    "edges", "sobel_rows", "edges_by_correlation", "apply_point_functions", "apply_kernel",
+    "tiled_filter", "tiled_correlate",
+    #loading and saving
+    "load_color_image", "load_greyscale_image", "save_color_image", "save_greyscale_image",
+    #seam carving
+    "greyscale_image_from_color_image", "compute_energy", "cumulative_energy_map",
+    "energy_seam", "minimum_energy_seam", "image_without_seam", "remove_seams",
+    "seam_carving", "incremental_seam_carving", "batch_seam_carving", "forward_energy_map",
+    "backward_energy_map", "batch_seams", "plan_seams", "seam_insertion", "insert_seams",
+    "planned_seam_carving", "retarget", "transposed",
+]
+
+#these touch one pixel per call rather than the whole image they are given
+PER_PIXEL = {"get_pixel", "set_pixel"}
+
+#name -> original function, while profiling is enabled
+originals = {}
+
+
+class StageStats:
+    """
+    Totals for one profiled function.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.pixels = 0
+        self.allocated = 0
+        self.peak_allocated = 0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "seconds": self.seconds,
+            "pixels": self.pixels,
+            "pixels_per_second": self.pixels / self.seconds if self.seconds else None,
+            "bytes_allocated": self.allocated,
+            "peak_bytes_allocated": self.peak_allocated,
+        }
+
+
+def image_pixels(args):
+    """
+    Returns the number of pixels in the image passed as the first argument of
+    a profiled call (an image, or a list of rows as used by sobel_rows and
+    the seam helpers), or 0 if it isn't an image.
+    """
+    if not args:
+        return 0
+    image = args[0]
+    if isinstance(image, image_processing.CompactImage):
+        return image.width * image.height
+    if isinstance(image, dict) and "width" in image and "height" in image:
+        return image["width"] * image["height"]
+    if isinstance(image, list) and image and isinstance(image[0], list):
+        return len(image) * len(image[0])
+    return 0
+
+
+def one_pixel(args):
+    return 1
+
+
+def profiled_function(func, stats, memory, frames, pixels=image_pixels):
+    """
+    Returns a wrapper around func that adds each call to stats, counting the
+    pixels processed with pixels(args).  frames is the stack of [traced memory
+    at entry, highest peak seen] for the calls in progress, so that nested
+    calls don't hide each other's peaks when they reset tracemalloc's peak.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if frames:
+                frames[-1][1] = max(frames[-1][1], peak)
+            tracemalloc.reset_peak()
+            frames.append([current, current])
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.seconds += time.perf_counter() - start
+            stats.calls += 1
+            stats.pixels += pixels(args)
+            if memory:
+                _, peak = tracemalloc.get_traced_memory()
+                entry, highest = frames.pop()
+                highest = max(highest, peak)
+                stats.allocated += highest - entry
+                stats.peak_allocated = max(stats.peak_allocated, highest - entry)
+                if frames:
+                    frames[-1][1] = max(frames[-1][1], highest)
+                tracemalloc.reset_peak()
+    return wrapper
+
+
+def enable(stages=None, memory=False):
+    """
+    Starts profiling the given function names (by default all of STAGES that
+    exist) and returns the dictionary mapping each name to its StageStats,
+    which fills in as the functions are called.  With memory=True, allocations
+    are traced with tracemalloc, which slows everything down considerably.
+    """
+    if originals:
+        raise RuntimeError("profiling is already enabled")
+    #only stop tracemalloc in disable if it was started here
+    enable.started_tracing = memory and not tracemalloc.is_tracing()
+    if enable.started_tracing:
+        tracemalloc.start()
+    stats = {}
+    frames = []
+    for name in stages or STAGES:
+        func = getattr(image_processing, name, None)
+        #generators return before doing any work, so timing them is useless
+        if func is None or not callable(func) or inspect.isgeneratorfunction(func):
+            continue
+        stats[name] = StageStats()
+        originals[name] = func
+        pixels = one_pixel if name in PER_PIXEL else image_pixels
+        setattr(image_processing, name, profiled_function(func, stats[name], memory, frames, pixels))
+    return stats
+
+
+def disable():
+    """
+    Restores the original functions.
+    """
+    for name, func in originals.items():
+        setattr(image_processing, name, func)
+    originals.clear()
+    if getattr(enable, "started_tracing", False):
+        tracemalloc.stop()
+        enable.started_tracing = False
+
+
+@contextmanager
+def profiling(stages=None, memory=False):
+    """
+    Context manager that profiles the given stages (see enable) and yields
+    their stats dictionary.
+    """
+    stats = enable(stages, memory)
+    try:
+        yield stats
+    finally:
+        disable()
+
+
+def report(stats):
+    """
+    Returns the stats of the functions that were called as a dictionary
+    suitable for JSON, sorted by time spent.
+    """
+    called = sorted(((name, s) for name, s in stats.items() if s.calls),
+                    key=lambda item: -item[1].seconds)
+    return {name: s.as_dict() for name, s in called}
+
+
+def report_text(stats):
+    """
+    Returns a table of the stats of the functions that were called, sorted
+    by time spent.
+    """
+    lines = [f"{'stage':<34}{'calls':>10}{'seconds':>11}{'ms/call':>10}{'Mpixels':>10}{'MB alloc':>10}"]
+    for name, s in report(stats).items():
+        lines.append(f"{name:<34}{s['calls']:>10}{s['seconds']:>11.4f}"
+                     f"{1000 * s['seconds'] / s['calls']:>10.3f}{s['pixels'] / 1e6:>10.3f}"
+                     f"{s['bytes_allocated'] / 2**20:>10.2f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile image_processing while running a script.")
+    parser.add_argument("--json", help="also write the report as JSON to this file")
+    parser.add_argument("--memory", action="store_true", help="trace allocations (slow)")
+    parser.add_argument("--stages", nargs="+", help="function names to profile")
+    parser.add_argument("script")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+    sys.argv = [args.script] + args.args
+    with profiling(args.stages, args.memory) as stats:
+        try:
+            runpy.run_path(args.script, run_name="__main__")
+        finally:
+            print(report_text(stats), file=sys.stderr)
+            if args.json:
+                with open(args.json, "w") as f:
+                    json.dump(report(stats), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import tracemalloc
+
+import pytest
+
+import image_processing
+import image_processing_profiler as profiler
+
+
+def test_disable_restores_the_original_functions():
+    originals = {name: getattr(image_processing, name, None) for name in profiler.STAGES}
+    stats = profiler.enable()
+    try:
+        assert image_processing.blurred is not originals["blurred"]
+        assert image_processing.blurred.__wrapped__ is originals["blurred"]
+        assert set(stats) <= set(profiler.STAGES)
+        with pytest.raises(RuntimeError):
+            profiler.enable()
+    finally:
+        profiler.disable()
+    assert {name: getattr(image_processing, name, None) for name in profiler.STAGES} == originals
+    assert not profiler.originals
+
+    #the context manager restores them even if the profiled code fails
+    with pytest.raises(ZeroDivisionError):
+        with profiler.profiling(["edges"]):
+            1 / 0
+    assert image_processing.edges is originals["edges"]
+
+
+def test_report_counts_calls_seconds_and_bytes():
+    width, height = 24, 10
+    im = {"height": height, "width": width, "pixels": [(7 * i) % 256 for i in range(width * height)]}
+    tracing = tracemalloc.is_tracing()
+    with profiler.profiling(["blurred", "box_sums", "round_and_clip_image", "edges"], memory=True) as stats:
+        image_processing.blurred(im, 3)
+        image_processing.blurred(im, 5)
+    assert tracemalloc.is_tracing() == tracing
+
+    report = profiler.report(stats)
+    #edges wasn't called, so it isn't reported
+    assert set(report) == {"blurred", "box_sums", "round_and_clip_image"}
+    for name in report:
+        assert report[name]["calls"] == 2
+        assert report[name]["seconds"] > 0
+        assert report[name]["pixels"] == 2 * width * height
+        assert report[name]["pixels_per_second"] > 0
+    #blurred's times and allocations include those of the calls it makes
+    assert report["blurred"]["seconds"] >= report["box_sums"]["seconds"]
+    assert report["box_sums"]["bytes_allocated"] > 0
+    assert report["blurred"]["peak_bytes_allocated"] >= report["box_sums"]["peak_bytes_allocated"]
+    assert list(report)[0] == "blurred"
+
+    lines = profiler.report_text(stats).splitlines()
+    assert lines[0].split()[:3] == ["stage", "calls", "seconds"]
+    assert [line.split()[:2] for line in lines[1:]] == [[name, "2"] for name in report]
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+A long-lived worker service for image_processing.py filters.
+
+Start it with, for example:
+    python image_processing_service.py serve --socket /tmp/images.sock --workers 4
+
+and send it requests with:
+    python image_processing_service.py call --socket /tmp/images.sock \\
+        '{"op": "filter", "input": "test_images/cat.png", "output": "out.png",
+          "pipeline": ["edges", "blur(5)"], "color": false}'
+    python image_processing_service.py call --socket /tmp/images.sock '{"op": "stats"}'
+
+The protocol is one JSON object per line over a Unix socket, answered by one
+JSON object per line.  A "filter" request loads the input image (converted
+to greyscale, or kept in color if "color" is true), runs the named stages of
+the pipeline in order and saves the result as a PNG at the output path.
+Stages are "inverted", "edges", "blur(n)" and "sharpen(n)".
+
+Requests are queued and handed to a process pool in batches, so the filters
+are only imported once per worker.  Results are cached by the SHA-256 of the
+input file plus the pipeline, with least recently used entries evicted once
+the cache holds more than a given number of bytes.  A "stats" request
+reports the queue depth, the cache counters and the latency of every stage.
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import socket
+import asyncio
+import hashlib
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import image_processing
+
+
+STAGE_PATTERN = re.compile(r"^(inverted|edges|blur|sharpen)(?:\((\d+)\))?$")
+
+
+def make_stage(name):
+    """
+    Returns the greyscale filter for a stage name such as "edges" or
+    "blur(5)", raising ValueError for unknown names.
+    """
+    match = STAGE_PATTERN.match(name.replace(" ", ""))
+    if match is None:
+        raise ValueError(f"unknown stage: {name!r}")
+    kind, n = match.groups()
+    if (n is None) != (kind in ("inverted", "edges")):
+        raise ValueError(f"stage {kind!r} " + ("needs a size" if n is None else "takes no size"))
+    if kind == "inverted":
+        return image_processing.inverted
+    if kind == "edges":
+        return image_processing.edges
+    if kind == "blur":
+        return image_processing.make_blur_filter(int(n))
+    return image_processing.make_sharpen_filter(int(n))
+
+
+def run_pipeline(filename, pipeline, color):
+    """
+    Loads an image, applies the stages of the pipeline in turn and returns
+    (PNG bytes of the result, {stage: seconds}).  Runs in a worker process.
+    """
+    timings = {}
+    start = time.perf_counter()
+    if color:
+        image = image_processing.load_color_image(filename, compact=True)
+    else:
+        image = image_processing.load_greyscale_image(filename, compact=True)
+    timings["load"] = time.perf_counter() - start
+    for name in pipeline:
+        filt = make_stage(name)
+        if color:
+            filt = image_processing.color_filter_from_greyscale_filter(filt)
+        start = time.perf_counter()
+        image = filt(image)
+        timings[name] = timings.get(name, 0) + time.perf_counter() - start
+    start = time.perf_counter()
+    out = io.BytesIO()
+    if color:
+        image_processing.save_color_image(image, out)
+    else:
+        image_processing.save_greyscale_image(image, out)
+    timings["save"] = time.perf_counter() - start
+    return out.getvalue(), timings
+
+
+def file_digest(filename):
+    """
+    Returns the SHA-256 hex digest of a file's contents.
+    """
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def write_file(filename, data):
+    with open(filename, "wb") as f:
+        f.write(data)
+
+
+def run_batch(jobs):
+    """
+    Runs a list of (filename, pipeline, color) jobs in one worker process,
+    returning a (result, error message) pair for each.
+    """
+    results = []
+    for job in jobs:
+        try:
+            results.append((run_pipeline(*job), None))
+        except Exception as e:
+            results.append((None, f"{type(e).__name__}: {e}"))
+    return results
+
+
+class ResultCache:
+    """
+    Maps keys to bytes, evicting the least recently used entries once the
+    values add up to more than max_bytes.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        if key in self.entries:
+            self.nbytes -= len(self.entries.pop(key))
+        self.entries[key] = value
+        self.nbytes += len(value)
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= len(evicted)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class LatencyStats:
+    """
+    Count, total and maximum of the latencies recorded under each name.
+    """
+    def __init__(self):
+        self.stages = {}
+
+    def record(self, name, seconds):
+        count, total, longest = self.stages.get(name, (0, 0.0, 0.0))
+        self.stages[name] = (count + 1, total + seconds, max(longest, seconds))
+
+    def stats(self):
+        return {
+            name: {"count": count, "total_seconds": total,
+                   "mean_seconds": total / count, "max_seconds": longest}
+            for name, (count, total, longest) in self.stages.items()
+        }
+
+
+class FilterService:
+    """
+    Queues filter requests and runs them in batches of up to batch_size on a
+    process pool with the given number of workers.  A batch is started as
+    soon as a request arrives and includes whatever else arrives within
+    batch_delay seconds.
+    """
+    def __init__(self, workers=None, cache_bytes=256 * 2**20, batch_size=16, batch_delay=0.01):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(self.workers)
+        self.cache = ResultCache(cache_bytes)
+        self.latency = LatencyStats()
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.queue = None
+        self.requests = 0
+        self.batches = 0
+        self.failures = 0
+
+    async def filter(self, message):
+        """
+        Handles a "filter" request, returning the response dictionary.
+        """
+        start = time.perf_counter()
+        pipeline = message["pipeline"]
+        if isinstance(pipeline, str):
+            pipeline = [pipeline]
+        pipeline = [name.replace(" ", "") for name in pipeline]
+        for name in pipeline:
+            make_stage(name)
+        color = bool(message.get("color", False))
+        self.requests += 1
+        #file I/O goes to a thread so that it does not hold up the event loop
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(None, file_digest, message["input"])
+        key = (digest, tuple(pipeline), color)
+        data = self.cache.get(key)
+        cached = data is not None
+        if not cached:
+            future = loop.create_future()
+            await self.queue.put(((message["input"], pipeline, color), key, future, time.perf_counter()))
+            data = await future
+        await loop.run_in_executor(None, write_file, message["output"], data)
+        seconds = time.perf_counter() - start
+        self.latency.record("request", seconds)
+        return {"ok": True, "output": message["output"], "cached": cached, "seconds": seconds}
+
+    def stats(self):
+        return {
+            "ok": True,
+            "queue_depth": self.queue.qsize(),
+            "workers": self.workers,
+            "requests": self.requests,
+            "batches": self.batches,
+            "failures": self.failures,
+            "cache": self.cache.stats(),
+            "stages": self.latency.stats(),
+        }
+
+    async def next_batch(self):
+        """
+        Waits for a queued request, then collects more for up to batch_delay
+        seconds.
+        """
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.batch_delay
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.next_batch()
+            self.batches += 1
+            #identical requests in a batch are only computed once
+            waiting = {}
+            for job, key, future, queued in batch:
+                self.latency.record("queue", time.perf_counter() - queued)
+                waiting.setdefault(key, (job, []))[1].append(future)
+            keys = list(waiting)
+            chunks = [keys[i::self.workers] for i in range(min(self.workers, len(keys)))]
+            results = await asyncio.gather(*(
+                loop.run_in_executor(self.pool, run_batch, [waiting[key][0] for key in chunk])
+                for chunk in chunks
+            ), return_exceptions=True)
+            for chunk, chunk_results in zip(chunks, results):
+                if isinstance(chunk_results, BaseException):
+                    chunk_results = [(None, f"{type(chunk_results).__name__}: {chunk_results}")] * len(chunk)
+                for key, (result, error) in zip(chunk, chunk_results):
+                    futures = waiting[key][1]
+                    if error is not None:
+                        self.failures += 1
+                        for future in futures:
+                            if not future.done():
+                                future.set_exception(RuntimeError(error))
+                        continue
+                    data, timings = result
+                    for name, seconds in timings.items():
+                        self.latency.record("stage " + name, seconds)
+                    self.cache.put(key, data)
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(data)
+
+    async def handle(self, reader, writer):
+        """
+        Answers the requests of one connection, one JSON line at a time.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    op = message.get("op", "filter")
+                    if op == "filter":
+                        response = await self.filter(message)
+                    elif op == "stats":
+                        response = self.stats()
+                    else:
+                        raise ValueError(f"unknown op: {op!r}")
+                except Exception as e:
+                    response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, path):
+        """
+        Serves requests on a Unix socket at path until cancelled.
+        """
+        self.queue = asyncio.Queue()
+        batches = asyncio.create_task(self.run_batches())
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self.handle, path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batches.cancel()
+            self.pool.shutdown(cancel_futures=True)
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def call(path, message):
+    """
+    Sends one request to a running service and returns its response.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall((json.dumps(message) + "\n").encode())
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run the service")
+    serve.add_argument("--socket", required=True)
+    serve.add_argument("--workers", type=int, default=None)
+    serve.add_argument("--cache-mb", type=float, default=256)
+    serve.add_argument("--batch-size", type=int, default=16)
+    serve.add_argument("--batch-delay", type=float, default=0.01, help="seconds")
+    client = commands.add_parser("call", help="send one JSON request to the service")
+    client.add_argument("--socket", required=True)
+    client.add_argument("message")
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        service = FilterService(args.workers, int(args.cache_mb * 2**20), args.batch_size, args.batch_delay)
+        try:
+            asyncio.run(service.serve(args.socket))
+        except KeyboardInterrupt:
+            pass
+    else:
+        json.dump(call(args.socket, json.loads(args.message)), sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
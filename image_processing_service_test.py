@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import os
+import asyncio
+
+import pytest
+
+import image_processing
+import image_processing_service
+
+
+def test_result_cache_evicts_least_recently_used():
+    cache = image_processing_service.ResultCache(10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa" and cache.get("c") == b"cccc"
+    cache.put("big", b"x" * 11)
+    assert cache.get("big") is None
+    assert cache.stats() == {
+        "entries": 2, "bytes": 8, "max_bytes": 10, "hits": 3, "misses": 2, "evictions": 1,
+    }
+
+
+def test_result_cache_replaces_entries():
+    cache = image_processing_service.ResultCache(10)
+    cache.put("a", b"aaaa")
+    cache.put("a", b"aaaaaa")
+    assert cache.get("a") == b"aaaaaa"
+    assert cache.stats()["bytes"] == 6 and cache.stats()["evictions"] == 0
+
+
+def test_make_stage():
+    assert image_processing_service.make_stage("edges") is image_processing.edges
+    assert callable(image_processing_service.make_stage("blur( 3 )"))
+    for name in ["blur", "edges(3)", "resize(2)"]:
+        with pytest.raises(ValueError):
+            image_processing_service.make_stage(name)
+
+
+def test_filter_service_round_trip(tmp_path):
+    image = {"height": 2, "width": 3, "pixels": [0, 50, 100, 150, 200, 250]}
+    source = str(tmp_path / "in.png")
+    image_processing.save_greyscale_image(image, source)
+    path = str(tmp_path / "service.sock")
+    request = {"op": "filter", "input": source, "output": str(tmp_path / "out.png"),
+               "pipeline": ["inverted"]}
+
+    async def session():
+        service = image_processing_service.FilterService(workers=1, batch_delay=0)
+        server = asyncio.create_task(service.serve(path))
+        while not os.path.exists(path):
+            await asyncio.sleep(0.01)
+        loop = asyncio.get_running_loop()
+        responses = []
+        for message in [request, request, {"op": "filter", "input": source, "output": "x.png",
+                                           "pipeline": ["resize(2)"]}, {"op": "stats"}]:
+            responses.append(await loop.run_in_executor(
+                None, image_processing_service.call, path, message))
+        server.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await server
+        return responses
+
+    first, second, bad, stats = asyncio.run(session())
+    assert first["ok"] and not first["cached"]
+    assert second["ok"] and second["cached"]
+    assert not bad["ok"] and "resize" in bad["error"]
+    assert stats["requests"] == 2 and stats["batches"] == 1
+    assert stats["cache"]["hits"] == 1 and stats["cache"]["misses"] == 1
+    result = image_processing.load_greyscale_image(str(tmp_path / "out.png"))
+    assert result["pixels"] == [255, 205, 155, 105, 55, 5]
+    assert not os.path.exists(path)
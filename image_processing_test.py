@@ -136,6 +136,58 @@ def test_color_filter_edges():
     compare_color_images(result, expected)
 
 
+def test_compact_image_round_trip():
+    im = lab.load_color_image("test_images/centered_pixel.png")
+    compact = lab.load_color_image("test_images/centered_pixel.png", compact=True)
+    assert compact.nbytes == 3 * 11 * 11
+    compare_color_images(compact.to_dict(), im)
+    compare_color_images(lab.CompactImage.from_dict(im).to_dict(), im)
+
+
+def test_empty_compact_color_image_stays_color():
+    empty = {"height": 1, "width": 0, "pixels": []}
+    assert lab.CompactImage.from_dict(empty, color=True).is_color
+    assert not lab.CompactImage.from_dict(empty).is_color
+    im = lab.CompactImage.from_dict({"height": 1, "width": 2, "pixels": [(1, 2, 3), (4, 5, 6)]})
+    carved = lab.seam_carving(im, 2)
+    assert (carved.width, carved.height, carved.is_color) == (0, 1, True)
+    grey = lab.greyscale_image_from_color_image(carved)
+    assert (grey.width, grey.height, grey.is_color) == (0, 1, False)
+
+
+@pytest.mark.parametrize("pixels", [[0, 7, 255], [1.5, 2.0, 300.0]])
+def test_compact_filters_on_planes(pixels):
+    im = {"height": 1, "width": 3, "pixels": pixels}
+    result = lab.inverted(lab.CompactImage.from_dict(im))
+    expected = lab.CompactImage.from_dict(lab.inverted(im))
+    assert result == expected
+    assert result.planes[0].typecode == expected.planes[0].typecode
+    color = {"height": 1, "width": 3, "pixels": [(p, 255 - p, p) for p in pixels]}
+    result = lab.greyscale_image_from_color_image(lab.CompactImage.from_dict(color))
+    assert result == lab.CompactImage.from_dict(lab.greyscale_image_from_color_image(color))
+
+
+@pytest.mark.parametrize("band_height", [1, 4, 20])
+def test_streamed_edges_match_edges(band_height):
+    fname = "test_images/centered_pixel.png"
+    bands = lab.filter_bands(lab.load_image_bands(fname, band_height), lab.edges, 1)
+    pixels = []
+    for band in bands:
+        pixels.extend(band.to_dict()["pixels"])
+    expected = lab.edges(lab.load_greyscale_image(fname))
+    assert pixels == expected["pixels"]
+
+
+@pytest.mark.parametrize("filter_name", ["edges", "inverted"])
+def test_compact_color_filter(filter_name):
+    im = lab.load_color_image("test_images/centered_pixel.png")
+    compact = lab.CompactImage.from_dict(im)
+    color_filter = lab.color_filter_from_greyscale_filter(getattr(lab, filter_name))
+    result = color_filter(compact)
+    assert isinstance(result, lab.CompactImage)
+    compare_color_images(result.to_dict(), color_filter(im))
+
+
 @pytest.mark.parametrize("fname", ["frog", "tree"])
 @pytest.mark.parametrize("filter_name", ["edges", "inverted"])
 def test_color_filter_images(fname, filter_name):
@@ -196,6 +248,133 @@ def test_blur_filter_images(fname, ker_size):
     compare_color_images(result, expected)
 
 
+@pytest.mark.parametrize("boundary", ["zero", "wrap", "extend"])
+@pytest.mark.parametrize(
+    "kernel",
+    [[-1, 0, 1, -2, 0, 2, -1, 0, 1], [0.04] * 25, [0, 0.5, 0, 1, -0.25, 0, 0, 0, 0]],
+)
+def test_correlate_matches_by_pixel(kernel, boundary):
+    im = {
+        "height": 5,
+        "width": 7,
+        "pixels": [(31 * i + 7) % 256 for i in range(35)],
+    }
+    result = lab.correlate(im, kernel, boundary)
+    expected = lab.correlate_by_pixel(im, kernel, boundary)
+    assert result == expected
+
+
+@pytest.mark.parametrize("pixels", [[2**62, 2**62], [-2**63, 2**70], [1.5, 2], [2, 0.25]])
+@pytest.mark.parametrize("kernel", [[0, 0, 0, 1, 1, 0, 0, 0, 0], [0, 0, 0, 0.5, 1, 0, 0, 0, 0]])
+def test_correlate_keeps_values_and_types(pixels, kernel):
+    #no int64 overflow, and ints stay ints wherever correlate_by_pixel keeps them
+    im = {"height": 1, "width": 2, "pixels": pixels}
+    result = lab.correlate(im, kernel, "zero")
+    expected = lab.correlate_by_pixel(im, kernel, "zero")
+    assert [(type(p), p) for p in result["pixels"]] == [(type(p), p) for p in expected["pixels"]]
+
+
+@pytest.mark.parametrize("boundary", ["zero", "wrap", "extend"])
+def test_tiled_correlate_matches_correlate(boundary):
+    im = {
+        "height": 13,
+        "width": 6,
+        "pixels": [(41 * i + 3) % 256 for i in range(78)],
+    }
+    kernel = [0.04] * 25
+    result = lab.tiled_correlate(im, kernel, boundary, workers=2, band_height=3)
+    assert result == lab.correlate(im, kernel, boundary)
+
+
+def test_filter_band_errors_are_not_hidden():
+    shared = lab.SharedMemory(create=True, size=4)
+    try:
+        #wrapping around zero rows fails while the rows are copied
+        with pytest.raises(ZeroDivisionError):
+            lab.filter_band(shared.name, "B", 2, 0, 0, 1, 0, "wrap", lab.inverted)
+    finally:
+        shared.close()
+        shared.unlink()
+
+
+def test_tiled_edges_matches_edges():
+    im = lab.load_greyscale_image("test_images/centered_pixel.png")
+    result = lab.tiled_filter(im, lab.edges, 1, workers=2, band_height=4)
+    compare_greyscale_images(result, lab.edges(im))
+
+
+def test_sobel_edges_match_correlation():
+    im = {
+        "height": 7,
+        "width": 8,
+        "pixels": [(i * i * 29 + 11 * i) % 256 for i in range(56)],
+    }
+    oim = object_hash(im)
+    result = lab.edges(im)
+    assert object_hash(im) == oim, "Be careful not to modify the original image!"
+    compare_greyscale_images(result, lab.edges_by_correlation(im))
+
+
+@pytest.mark.parametrize("ker_size", [1, 3, 4, 7, 31])
+def test_box_blur_matches_correlate(ker_size):
+    im = {
+        "height": 6,
+        "width": 9,
+        "pixels": [(7 * i * i + 13 * i) % 256 for i in range(54)],
+    }
+    oim = object_hash(im)
+    kernel = lab.blur_kernel_creator(ker_size)
+    expected = lab.round_and_clip_image(lab.correlate(im, kernel, "extend"))
+    result = lab.blurred(im, ker_size)
+    assert object_hash(im) == oim, "Be careful not to modify the original image!"
+    compare_greyscale_images(result, expected)
+
+
+def test_box_blur_of_floats_matches_correlate():
+    #running sums of floats drift: 1e16 swamps 33.3 in the sum of the first
+    #two pixels, and the last pixel would round to 64 instead of 65
+    im = {"height": 1, "width": 3, "pixels": [1e16, 127.5, 33.3]}
+    kernel = lab.blur_kernel_creator(3)
+    expected = lab.round_and_clip_image(lab.correlate_by_pixel(im, kernel, "extend"))
+    assert lab.blurred(im, 3) == expected == {"height": 1, "width": 3, "pixels": [255, 255, 65]}
+
+
+@pytest.mark.parametrize("func", [lambda c: 255 - c, lambda c: c / 3, lambda c: c * 2])
+def test_apply_per_pixel_lookup_table(func):
+    im = {
+        "height": 4,
+        "width": 5,
+        "pixels": [(37 * i) % 256 for i in range(20)],
+    }
+    oim = object_hash(im)
+    result = lab.apply_per_pixel(im, func)
+    assert object_hash(im) == oim, "Be careful not to modify the original image!"
+    assert result == {"height": 4, "width": 5, "pixels": [func(c) for c in im["pixels"]]}
+
+
+def test_apply_per_pixel_is_not_stale():
+    im = {"height": 1, "width": 3, "pixels": [0, 10, 20]}
+    offset = [1]
+    def shifted(c):
+        return c + offset[0]
+    assert lab.apply_per_pixel(im, shifted)["pixels"] == [1, 11, 21]
+    offset[0] = 5
+    assert lab.apply_per_pixel(im, shifted)["pixels"] == [5, 15, 25]
+
+
+def test_apply_per_pixel_only_calls_func_on_pixels():
+    im = {"height": 1, "width": 2, "pixels": [4, 8]}
+    assert lab.apply_per_pixel(im, lambda c: 256 // c)["pixels"] == [64, 32]
+    with pytest.raises(ZeroDivisionError):
+        lab.apply_per_pixel({"height": 1, "width": 2, "pixels": [0, 8]}, lambda c: 256 // c)
+
+
+def test_cached_kernels_are_copied():
+    kernel = lab.blur_kernel_creator(3)
+    kernel[0] = 5
+    assert lab.blur_kernel_creator(3) == [1 / 9] * 9
+
+
 @pytest.mark.parametrize("ker_size", [3, 5])
 @pytest.mark.parametrize("fname", ["construct", "bluegill"])
 def test_sharpen_filter_images(fname, ker_size):
@@ -241,6 +420,32 @@ def test_small_cascade():
     compare_color_images(result, expected)
 
 
+def test_fused_cascade_with_executor():
+    from concurrent.futures import ThreadPoolExecutor
+
+    im = lab.load_color_image("test_images/centered_pixel.png")
+    filters = [lab.edges, lab.inverted, lab.make_blur_filter(5)]
+    expected = im
+    for filt in filters:
+        expected = lab.color_filter_from_greyscale_filter(filt)(expected)
+    with ThreadPoolExecutor(3) as executor:
+        f_cascade = lab.filter_cascade(
+            [lab.color_filter_from_greyscale_filter(f, executor) for f in filters]
+        )
+        result = f_cascade(im)
+    compare_color_images(result, expected)
+
+
+def test_cascade_fuses_point_filters():
+    color_inverted = lab.color_filter_from_greyscale_filter(lab.inverted)
+    color_edges = lab.color_filter_from_greyscale_filter(lab.edges)
+    im = lab.load_color_image("test_images/centered_pixel.png")
+    f_cascade = lab.filter_cascade([color_edges, color_inverted, color_inverted, color_inverted])
+    explanation = f_cascade.explain()
+    assert "fused 3 per-pixel operations" in explanation
+    compare_color_images(f_cascade(im), color_inverted(color_edges(im)))
+
+
 @pytest.mark.parametrize("cascade", [0, 1, 2])
 @pytest.mark.parametrize("image", ["tree", "stronger"])
 def test_cascades(cascade, image):
@@ -326,6 +531,142 @@ def test_seamcarving_smallfrog():
 def test_seamcarving_mushroom():
     seams_endtoend("smallmushroom.png", "seams_mushroom", 47)
 
+def test_energy_seam_matches_cumulative_map():
+    energy = {
+        "height": 7,
+        "width": 6,
+        "pixels": [(i * i + 5 * i) % 9 for i in range(42)],
+    }
+    cem = lab.cumulative_energy_map(energy)
+    assert cem["pixels"][:6] == energy["pixels"][:6]
+    for y in range(1, 7):
+        for x in range(6):
+            above = [cem["pixels"][(y - 1) * 6 + k] for k in (x - 1, x, x + 1) if 0 <= k < 6]
+            assert cem["pixels"][y * 6 + x] == min(above) + energy["pixels"][y * 6 + x]
+    seam = lab.energy_seam(energy)
+    assert seam == lab.minimum_energy_seam(cem)
+    assert [i // 6 for i in seam] == list(range(7))
+
+
+@pytest.mark.parametrize("later", [7, 7.5])
+def test_cumulative_energy_rows_inputs(later, monkeypatch):
+    pixels = [3, 1, 2, 5, 4, 2, 6, 1, 3, 7, 4, 2, 5, 1, later]
+    energy = {"height": 3, "width": 5, "pixels": pixels}
+    def rows(energy):
+        return [(list(row), list(offsets)) for row, offsets in lab.cumulative_energy_rows(energy)]
+    results = [rows(energy), rows(dict(energy, pixels=tuple(pixels)))]
+    if later == 7:
+        results.append(rows(dict(energy, pixels=lab.array("H", pixels))))
+    monkeypatch.setattr(lab, "numpy", None)
+    expected = rows(energy)
+    assert expected[-1] == ([7, 4, 7, 3, 5 + later], [0, 1, 0, -1, -1])
+    for result in results:
+        assert result == expected
+
+
+@pytest.mark.parametrize("ncols", [1, 4, 9])
+def test_incremental_seam_carving_matches_full(ncols):
+    im = {
+        "height": 8,
+        "width": 10,
+        "pixels": [((i * 37) % 256, (i * i) % 256, (255 - 3 * i) % 256) for i in range(80)],
+    }
+    oim = object_hash(im)
+    result = lab.seam_carving(im, ncols)
+    assert object_hash(im) == oim, "Be careful not to modify the original image!"
+    compare_color_images(result, lab.seam_carving(im, ncols, incremental=False))
+
+
+@pytest.mark.parametrize("ncols", [1, 4, 9])
+def test_incremental_seam_carving_without_numpy(ncols, monkeypatch):
+    im = {
+        "height": 8,
+        "width": 10,
+        "pixels": [((i * 37) % 256, (i * i) % 256, (255 - 3 * i) % 256) for i in range(80)],
+    }
+    expected = lab.incremental_seam_carving(im, ncols)
+    monkeypatch.setattr(lab, "numpy", None)
+    compare_color_images(lab.incremental_seam_carving(im, ncols), expected)
+
+def test_remove_seams_in_place():
+    im = {"height": 3, "width": 4, "pixels": [(i, i, i) for i in range(12)]}
+    seams = [[1, 6, 9], [3, 7, 11]]
+    result, index_map = lab.remove_seams(im, seams, in_place=True)
+    assert result is im
+    expected = {"height": 3, "width": 2, "pixels": [(0, 0, 0), (2, 2, 2), (4, 4, 4), (5, 5, 5), (8, 8, 8), (10, 10, 10)]}
+    compare_color_images(result, expected)
+    assert list(index_map) == [0, 2, 4, 5, 8, 10]
+    assert lab.remap(list(range(100, 112)), index_map) == [100, 102, 104, 105, 108, 110]
+
+
+@pytest.mark.parametrize("seams", [[[1, 6, 9], [1, 5, 10]], [[1, 6]], [[1, 2, 6, 9]]])
+def test_remove_seams_rejects_bad_seams(seams):
+    im = {"height": 3, "width": 4, "pixels": [(i, i, i) for i in range(12)]}
+    with pytest.raises(ValueError):
+        lab.remove_seams(im, seams)
+    assert im["pixels"] == [(i, i, i) for i in range(12)]
+
+
+@pytest.mark.parametrize("energy", ["backward", "forward"])
+def test_batch_seam_carving(energy):
+    im = lab.load_color_image("test_images/centered_pixel.png")
+    oim = object_hash(im)
+    result = lab.seam_carving(im, 5, seams_per_pass=3, energy=energy)
+    assert object_hash(im) == oim, "Be careful not to modify the original image!"
+    assert result["width"] == 6 and result["height"] == 11
+    assert len(result["pixels"]) == 66
+
+
+def test_batch_seams_are_disjoint():
+    cem = [[3, 1, 2, 5, 4], [2, 6, 1, 3, 7], [4, 2, 5, 1, 6]]
+    seams = lab.batch_seams(cem, 3, lambda y, x, p: cem[y - 1][p])
+    assert seams[0] == [1, 2, 3]
+    for y in range(3):
+        assert len({seam[y] for seam in seams}) == len(seams)
+
+
+def test_plan_seams_are_disjoint_and_connected():
+    energy = {"height": 4, "width": 5, "pixels": [3, 1, 2, 5, 4, 2, 6, 1, 3, 7, 4, 2, 5, 1, 6, 9, 0, 0, 8, 9]}
+    rows = lab.plan_seams(energy, 3)
+    assert len(rows) == 4
+    for y, row in enumerate(rows):
+        assert len(row) == 3 and row == sorted(set(row)) and 0 <= row[0] and row[-1] < 5
+        if y:
+            assert all(abs(a - b) <= 1 for a, b in zip(row, rows[y - 1]))
+
+
+def test_seam_insertion_averages_neighbors():
+    im = {"height": 1, "width": 3, "pixels": [(0, 0, 0), (10, 10, 10), (20, 20, 20)]}
+    result = lab.seam_insertion(im, 1)
+    expected = {"height": 1, "width": 4, "pixels": [(0, 0, 0), (5, 5, 5), (10, 10, 10), (20, 20, 20)]}
+    compare_color_images(result, expected)
+
+
+def test_retarget_without_numpy(monkeypatch):
+    im = {
+        "height": 9,
+        "width": 12,
+        "pixels": [((i * 37) % 256, (i * i) % 256, (255 - 3 * i) % 256) for i in range(108)],
+    }
+    sizes = [(17, 9), (12, 14), (7, 5), (15, 6)]
+    expected = [lab.retarget(im, width, height) for width, height in sizes]
+    monkeypatch.setattr(lab, "numpy", None)
+    for (width, height), result in zip(sizes, expected):
+        compare_color_images(lab.retarget(im, width, height), result)
+
+
+def test_seam_insertion_and_retarget():
+    im = lab.load_color_image('test_images/centered_pixel.png')
+    wider = lab.seam_insertion(im, 5)
+    assert (wider['width'], wider['height']) == (im['width'] + 5, im['height'])
+    assert len(wider['pixels']) == wider['width'] * wider['height']
+    assert lab.transposed(lab.transposed(im)) == im
+    for width, height in [(8, 14), (14, 8), (im['width'], im['height'])]:
+        result = lab.retarget(im, width, height)
+        assert (result['width'], result['height']) == (width, height)
+        assert len(result['pixels']) == width * height
+
+
 def test_presence_of_custom_feature():
     assert hasattr(lab, 'custom_feature'), "Custom feature code is not present!"
     assert callable(lab.custom_feature), "custom_feature should be a function"